@@ -0,0 +1,349 @@
+"""Asyncio runtime: the shared handlers on AsyncTeleBot behind an aiohttp webhook server.
+
+Run with: python async_bot.py
+
+One event loop holds every in-flight update, so a slow Bot API call
+costs a suspended coroutine instead of a blocked thread. The shared
+handlers are synchronous and may block on the user store or payment
+book, so they run in a thread pool and only the Bot API calls they
+return are made on the loop. Updates of the same chat are still handled
+one at a time, in arrival order.
+"""
+import time
+# Taken before the heavy imports so the startup breakdown covers them
+STARTED = time.perf_counter()
+import asyncio
+import contextlib
+import logging
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+
+import handlers
+import ingress
+import keep_alive
+import log_pipeline
+import metrics
+import rate_limiter
+import startup
+from update_queue import chat_key, update_type
+
+# Load environment variables
+load_dotenv()
+
+# Structured logs, written to stdout by a background thread
+log_pipeline.install()
+logger = logging.getLogger(__name__)
+
+timer = startup.StartupTimer(STARTED)
+timer.mark('imports')
+
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+if not BOT_TOKEN:
+    logger.error("BOT_TOKEN not found in environment variables!")
+    exit(1)
+
+PORT = int(os.getenv('PORT', '8080'))
+# Updates handled concurrently before the webhook answers 503
+MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', '5000'))
+# Threads running the synchronous handlers, i.e. concurrent store and payment calls
+HANDLER_THREADS = int(os.getenv('ASYNC_HANDLER_THREADS', '32'))
+# Bind the port first and read the user store and screens on first use
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', '1') == '1'
+
+bot = AsyncTeleBot(BOT_TOKEN)
+outbound = rate_limiter.from_env()
+# Times a call is retried after a 429 before the error is passed on
+MAX_RETRIES = 3
+_process_request = asyncio_helper._process_request
+
+
+async def process_request(token, url, method='get', params=None, files=None, **kwargs):
+    """Bot API request through the outbound rate limiter, retrying after 429s"""
+    chat_id = (params or {}).get('chat_id')
+    if chat_id is not None:
+        delay = outbound.reserve(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    for attempt in range(MAX_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            return await _process_request(token, url, method, params, files, **kwargs)
+        except asyncio_helper.ApiTelegramException as e:
+            metrics.API_ERRORS.inc(url, str(e.error_code))
+            if e.error_code != 429 or attempt == MAX_RETRIES:
+                raise
+            wait = rate_limiter.retry_after(e.result_json)
+        finally:
+            metrics.API_SECONDS.observe(time.perf_counter() - started, url)
+        outbound.backoff(wait)
+        await asyncio.sleep(wait)
+        rate_limiter.rewind_files(files)
+
+
+# Every AsyncTeleBot method goes through asyncio_helper._process_request
+asyncio_helper._process_request = process_request
+
+
+class ChatLocks:
+    """One asyncio lock per chat with pending updates; locks wake waiters in FIFO order"""
+
+    def __init__(self):
+        self.locks = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self.locks.get(key)
+        if entry is None:
+            entry = self.locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[key]
+
+
+chat_locks = ChatLocks()
+# Same ingress filtering as the threaded runtime
+ingress_filter = ingress.from_env(exempt=handlers.from_admin)
+in_flight = set()
+metrics.Gauge('bot_async_updates_in_flight', 'Updates being handled on the event loop',
+              lambda: len(in_flight))
+
+
+async def execute(calls):
+    """Make the Bot API calls returned by a shared handler"""
+    for call in calls or ():
+        await getattr(bot, call.method)(*call.args, **call.kwargs)
+
+
+async def download_document(message):
+    """Bytes of an uploaded document, or None if the handlers do not accept it"""
+    if not handlers.accepts_upload(message):
+        return None
+    file_info = await bot.get_file(message.document.file_id)
+    return await bot.download_file(file_info.file_path)
+
+
+def message_handler(kind, name, handler):
+    """Wrap a shared message handler for AsyncTeleBot"""
+    async def handle(message):
+        # Off the loop: the handler may block on the store
+        if kind == 'document':
+            return await asyncio.to_thread(handler, message, await download_document(message))
+        return await asyncio.to_thread(handler, message)
+
+    async def run(message):
+        started = time.perf_counter()
+        failed = True
+        try:
+            if handlers.is_admin(message):
+                with rate_limiter.urgent():
+                    await execute(await handle(message))
+            else:
+                await execute(await handle(message))
+            failed = False
+        finally:
+            metrics.observe_handler(kind, name, time.perf_counter() - started, failed)
+    return run
+
+
+for kind, name, filters, handler in handlers.MESSAGE_HANDLERS:
+    bot.register_message_handler(message_handler(kind, name, handler), **filters)
+
+
+@bot.callback_query_handler(func=handlers.has_route)
+async def handle_callback(call):
+    """Handle inline button clicks"""
+    started = time.perf_counter()
+    failed = False
+    try:
+        await execute(await asyncio.to_thread(handlers.handle_callback, call))
+    except Exception as e:
+        if not handlers.is_unchanged_edit(e):
+            failed = True
+            await execute(handlers.callback_error(call, e))
+    metrics.observe_handler('callback', handlers.route_name(call), time.perf_counter() - started, failed)
+
+
+async def deliver(calls):
+    """Make independent Bot API calls, logging the ones that fail"""
+    for call in calls:
+        try:
+            await execute([call])
+        except Exception as e:
+            logger.error("%s failed: %s", call.method, e)
+
+
+async def process_update(update):
+    """Handle one update after the earlier updates of its chat"""
+    chat_id = chat_key(update)
+    async with chat_locks.hold(chat_id):
+        try:
+            with log_pipeline.update_context(update, chat_id):
+                await bot.process_new_updates([update])
+        except Exception as e:
+            logger.error("Update %s failed: %s", update.update_id, e)
+
+
+# Pings the public URL only when no request came in for a while
+keeper = keep_alive.from_env(os.getenv('RENDER_URL', 'https://v1-bot-cd3b.onrender.com'))
+
+
+@web.middleware
+async def track_activity(request, handler):
+    """Any inbound request keeps the host awake"""
+    keeper.touch()
+    return await handler(request)
+
+
+async def home(request):
+    return web.Response(text="Secret Info Bot is running!")
+
+
+async def webhook(request):
+    """Handle Telegram webhook updates"""
+    if request.content_type == 'application/json':
+        update = types.Update.de_json(await request.text())
+        metrics.UPDATES.inc(update_type(update))
+        reason = ingress_filter.check(update)
+        if reason is not None:
+            calls = handlers.dropped_update(update, reason)
+            if calls:
+                task = asyncio.create_task(deliver(calls))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            return web.Response(text='')
+        if len(in_flight) >= MAX_IN_FLIGHT:
+            # Too much work in flight, let Telegram redeliver later
+            ingress_filter.forget(update)
+            return web.Response(status=503, text='Busy')
+        task = asyncio.create_task(process_update(update))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        return web.Response(text='')
+    return web.Response(text='OK')
+
+
+async def health(request):
+    """Liveness and keep-alive state"""
+    return web.json_response({'status': 'ok', 'keep_alive': keeper.state()})
+
+
+async def metrics_endpoint(request):
+    """Prometheus metrics"""
+    return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+
+async def keep_alive_ping():
+    """Ping the app when it has been idle close to the free server's sleep threshold"""
+    timeout = aiohttp.ClientTimeout(total=10)
+    while True:
+        await asyncio.sleep(keeper.next_ping_in())
+        if not keeper.should_ping():
+            continue
+        try:
+            # Same pooled connections as the Bot API calls
+            session = await asyncio_helper.session_manager.get_session()
+            async with session.get(keeper.url, timeout=timeout) as response:
+                keeper.record(response.status)
+                if response.status == 200:
+                    logger.info("Keep-alive ping successful: %d", response.status)
+                else:
+                    logger.warning("Keep-alive ping warning: %d", response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            keeper.record(None, e)
+            logger.warning("Keep-alive ping failed: %s", e)
+        except Exception as e:
+            # Anything else must not end the ping loop; cancellation still does
+            keeper.record(None, e)
+            logger.error("Keep-alive ping error: %s", e)
+
+
+async def setup_webhook(render_url):
+    """Point Telegram at our /webhook URL"""
+    webhook_url = f"{render_url}/webhook"
+
+    # After a restart the webhook is usually still in place
+    if (await bot.get_webhook_info()).url == webhook_url:
+        logger.info("Webhook already set to: %s", webhook_url)
+        return
+
+    # set_webhook replaces any existing webhook, no need to remove it first
+    await bot.set_webhook(url=webhook_url)
+    logger.info("Webhook set to: %s", webhook_url)
+
+
+async def main():
+    """Serve the webhook on the event loop until SIGTERM or Ctrl+C"""
+    timer.mark('init')
+    # asyncio.to_thread runs the handlers on the default executor
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(HANDLER_THREADS, thread_name_prefix='handler')
+    )
+    app = web.Application(middlewares=[track_activity])
+    app.router.add_get('/', home)
+    app.router.add_post('/webhook', webhook)
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics_endpoint)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', PORT).start()
+    logger.info("Async webhook server started on port %d", PORT)
+    timer.mark('bind')
+
+    # Webhook requests accepted meanwhile are handled once this yields to the loop
+    handlers.load_users(lazy=LAZY_STARTUP)
+    if not LAZY_STARTUP:
+        handlers.screens.build()
+    # The scheduler thread hands expiry notices back to the event loop
+    loop = asyncio.get_running_loop()
+    handlers.start_expirations(lambda calls: asyncio.run_coroutine_threadsafe(deliver(calls), loop))
+    handlers.start_payments(lambda calls: asyncio.run_coroutine_threadsafe(deliver(calls), loop))
+    # Broadcast workers wait for each send, so a failure is recorded per recipient
+    handlers.start_broadcasts(lambda call: asyncio.run_coroutine_threadsafe(execute([call]), loop).result())
+    timer.mark('workers')
+
+    render_url = os.getenv('RENDER_URL', 'https://v1-bot-cd3b.onrender.com')
+    keep_alive_task = asyncio.create_task(keep_alive_ping())
+    try:
+        await setup_webhook(render_url)
+        timer.mark('webhook')
+        timer.report()
+        logger.info("Bot is ready! Telegram will send updates to the webhook.")
+    except Exception as e:
+        logger.error("Failed to set webhook: %s", e)
+
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loop.add_signal_handler(signal.SIGINT, stopping.set)
+    await stopping.wait()
+    logger.info("Shutting down...")
+
+    # Stop accepting requests, then let in-flight updates finish
+    keep_alive_task.cancel()
+    await runner.cleanup()
+    if in_flight:
+        await asyncio.gather(*in_flight, return_exceptions=True)
+    handlers.expirations.stop()
+    handlers.stop_payments()
+    # Off the loop: the broadcast workers finish their sends on it
+    await asyncio.to_thread(handlers.stop_broadcasts)
+    await bot.close_session()
+    handlers.user_store.close()
+    logger.info("Update handling stopped")
+    log_pipeline.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Benchmark the update queue throughput as the worker count grows.
+
+Each simulated update sleeps for the given Bot API round-trip time, the
+same way a handler blocks on send_message/edit_message_text. Updates
+are spread over many chats and the per-chat order is checked at the end.
+
+Usage: python bench_dispatcher.py [updates] [chats] [latency_ms]
+"""
+import sys
+import threading
+import time
+
+from telebot import types
+
+from update_queue import UpdateQueue
+
+
+def make_updates(count, chats):
+    """Build callback updates round-robin over the given number of chats"""
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = 1000 + update_id % chats
+        updates.append(types.Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'data': 'packages',
+                'chat_instance': str(chat_id),
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+                'message': {
+                    'message_id': 1,
+                    'date': 0,
+                    'chat': {'id': chat_id, 'type': 'private'}
+                }
+            }
+        }))
+    return updates
+
+
+def run(updates, workers, latency):
+    """Push all updates through a queue with the given worker count"""
+    seen = {}
+    handled = [0]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def handler(update):
+        time.sleep(latency)
+        chat_id = update.callback_query.message.chat.id
+        with lock:
+            seen.setdefault(chat_id, []).append(update.update_id)
+            handled[0] += 1
+            if handled[0] == len(updates):
+                done.set()
+
+    # Every shard gets room for the whole run so nothing is rejected
+    update_queue = UpdateQueue(handler, workers=workers, maxsize=len(updates) * workers)
+    update_queue.start()
+    started = time.perf_counter()
+    for update in updates:
+        update_queue.put(update)
+    done.wait()
+    elapsed = time.perf_counter() - started
+    update_queue.stop()
+
+    ordered = all(ids == sorted(ids) for ids in seen.values())
+    return elapsed, ordered
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    latency = (float(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000
+
+    updates = make_updates(count, chats)
+    print(f"{count} updates, {chats} chats, {latency * 1000:.0f} ms per API call")
+    print(f"{'workers':>8} {'seconds':>9} {'updates/s':>10} {'speedup':>8} {'ordered':>8}")
+    baseline = None
+    for workers in (1, 2, 4, 8, 16, 32):
+        elapsed, ordered = run(updates, workers, latency)
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {count / elapsed:>10.1f} "
+              f"{baseline / elapsed:>7.1f}x {'yes' if ordered else 'NO':>8}")
+
+
+if __name__ == '__main__':
+    main()
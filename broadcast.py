@@ -0,0 +1,343 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastLog:
+    """Broadcasts, their checkpoints and per-recipient delivery status in SQLite.
+
+    A broadcast walks the recipients of each tier in ascending user_id
+    order and stores (cursor_tier, cursor_user) after every page, so an
+    interrupted broadcast resumes after the last finished page. The
+    deliveries table holds one row per recipient, written as 'sending'
+    just before its send and updated to sent, failed or blocked right
+    after, so the recipients of a page that was cut short are not sent
+    twice; the few whose send was in flight are counted as failed on
+    resume, and the counters are recounted from the table. The
+    process running a broadcast holds a lease on it that it renews while
+    sending; when the lease runs out, e.g. because the process died, any
+    process may claim the broadcast and resume it.
+    """
+
+    def __init__(self, path='broadcasts.db', lease=60):
+        self.path = path
+        self.lease = lease
+        self.local = threading.local()
+
+    def load(self):
+        """Create the schema"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS broadcasts ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'text TEXT NOT NULL, '
+                'target TEXT NOT NULL, '
+                'admin_chat INTEGER, '
+                'state TEXT NOT NULL, '
+                'total INTEGER NOT NULL, '
+                'sent INTEGER NOT NULL DEFAULT 0, '
+                'failed INTEGER NOT NULL DEFAULT 0, '
+                'blocked INTEGER NOT NULL DEFAULT 0, '
+                'rate REAL, '
+                'cursor_tier TEXT, '
+                'cursor_user INTEGER, '
+                'created_at REAL NOT NULL, '
+                'finished_at REAL, '
+                'lease_until REAL NOT NULL DEFAULT 0)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS broadcasts_state ON broadcasts (state)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS deliveries ('
+                'broadcast_id INTEGER NOT NULL, '
+                'user_id INTEGER NOT NULL, '
+                'status TEXT NOT NULL, '
+                'error TEXT, '
+                'at REAL NOT NULL, '
+                'PRIMARY KEY (broadcast_id, user_id)) WITHOUT ROWID'
+            )
+
+    def create(self, text, target, admin_chat, total):
+        """Queue a broadcast; returns its id, or None if one is already running"""
+        conn = self._conn()
+        with conn:
+            if conn.execute("SELECT 1 FROM broadcasts WHERE state = 'running'").fetchone():
+                return None
+            return conn.execute(
+                "INSERT INTO broadcasts (text, target, admin_chat, state, total, created_at) "
+                "VALUES (?, ?, ?, 'running', ?, ?)", (text, target, admin_chat, total, time.time())
+            ).lastrowid
+
+    def claim(self):
+        """Take the lease on a running broadcast nobody holds; returns its row as a dict, or None"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            row = conn.execute(
+                "UPDATE broadcasts SET lease_until = ? WHERE id = ("
+                "SELECT id FROM broadcasts WHERE state = 'running' AND lease_until < ? ORDER BY id LIMIT 1) "
+                "RETURNING *", (now + self.lease, now)
+            ).fetchone()
+            if row is not None:
+                # Sends cut short by the previous holder may or may not have arrived
+                interrupted = conn.execute(
+                    "UPDATE deliveries SET status = 'failed', error = 'Interrupted while sending' "
+                    "WHERE broadcast_id = ? AND status = 'sending'", (row[0],)
+                ).rowcount
+                if interrupted:
+                    logger.warning("Broadcast %d: %d sends were interrupted", row[0], interrupted)
+                row = conn.execute(
+                    "UPDATE broadcasts SET "
+                    "sent = (SELECT COUNT(*) FROM deliveries WHERE broadcast_id = id AND status = 'sent'), "
+                    "failed = (SELECT COUNT(*) FROM deliveries WHERE broadcast_id = id AND status = 'failed'), "
+                    "blocked = (SELECT COUNT(*) FROM deliveries WHERE broadcast_id = id AND status = 'blocked') "
+                    "WHERE id = ? RETURNING *", (row[0],)
+                ).fetchone()
+        return self._row(row)
+
+    def renew(self, broadcast_id):
+        """Extend the lease while a page is being sent"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE broadcasts SET lease_until = ? WHERE id = ? AND state = 'running'",
+                (time.time() + self.lease, broadcast_id)
+            )
+
+    def record(self, broadcast_id, user_id, status, error=None):
+        """Store a recipient's status: 'sending' before the send, so it is not sent again after a crash"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO deliveries VALUES (?, ?, ?, ?, ?)',
+                (broadcast_id, user_id, status, error, time.time())
+            )
+
+    def delivered(self, broadcast_id, user_ids):
+        """The ids among user_ids that already have a delivery status"""
+        placeholders = ', '.join('?' * len(user_ids))
+        return {row[0] for row in self._conn().execute(
+            f'SELECT user_id FROM deliveries WHERE broadcast_id = ? AND user_id IN ({placeholders})',
+            (broadcast_id, *user_ids)
+        )}
+
+    def checkpoint(self, broadcast_id, results, tier, user_id, rate):
+        """Count a page's deliveries and move the cursor; returns False if the broadcast was cancelled"""
+        now = time.time()
+        counts = {'sent': 0, 'failed': 0, 'blocked': 0}
+        for _, status, _ in results:
+            counts[status] += 1
+        conn = self._conn()
+        with conn:
+            updated = conn.execute(
+                "UPDATE broadcasts SET sent = sent + ?, failed = failed + ?, blocked = blocked + ?, "
+                "rate = ?, cursor_tier = ?, cursor_user = ?, lease_until = ? "
+                "WHERE id = ? AND state = 'running'",
+                (counts['sent'], counts['failed'], counts['blocked'], rate, tier, user_id,
+                 now + self.lease, broadcast_id)
+            ).rowcount
+        return bool(updated)
+
+    def finish(self, broadcast_id):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE broadcasts SET state = 'done', finished_at = ?, lease_until = 0 "
+                "WHERE id = ? AND state = 'running'", (time.time(), broadcast_id)
+            )
+
+    def release(self, broadcast_id):
+        """Give up the lease so another process or a restart resumes the broadcast"""
+        conn = self._conn()
+        with conn:
+            conn.execute('UPDATE broadcasts SET lease_until = 0 WHERE id = ?', (broadcast_id,))
+
+    def cancel(self):
+        """Cancel the running broadcast; returns its id, or None"""
+        conn = self._conn()
+        with conn:
+            row = conn.execute(
+                "UPDATE broadcasts SET state = 'cancelled', finished_at = ?, lease_until = 0 "
+                "WHERE state = 'running' RETURNING id", (time.time(),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, broadcast_id):
+        """A broadcast as a dict, or None"""
+        return self._row(self._conn().execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone())
+
+    def latest(self):
+        """The most recent broadcast as a dict, or None"""
+        return self._row(self._conn().execute('SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1').fetchone())
+
+    def _row(self, row):
+        if row is None:
+            return None
+        columns = ('id', 'text', 'target', 'admin_chat', 'state', 'total', 'sent', 'failed', 'blocked',
+                   'rate', 'cursor_tier', 'cursor_user', 'created_at', 'finished_at', 'lease_until')
+        return dict(zip(columns, row))
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return conn
+
+
+class Broadcaster:
+    """Runs broadcasts in a background thread through a rate-limited worker pool.
+
+    recipients(tier, after, limit) returns up to limit user ids of a tier
+    above after, in ascending order, and is read one page at a time, so
+    the recipient list is never held in memory. message(broadcast, user_id)
+    builds the ApiCall for a recipient and send(call) makes it, raising on
+    failure; on_finished(broadcast) is called with the final row. Sends
+    share one token bucket of rate per second, kept below the global
+    outbound limit so interactive replies still get through.
+    """
+
+    def __init__(self, log, tiers, recipients, message, send, on_finished=None, workers=8, rate=20,
+                 page_size=100, poll_interval=30):
+        self.log = log
+        self.tiers = tiers
+        self.recipients = recipients
+        self.message = message
+        self.send = send
+        self.on_finished = on_finished
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.bucket_lock = threading.Lock()
+        self.page_size = page_size
+        self.poll_interval = poll_interval
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        """Start the broadcast thread, resuming an interrupted broadcast"""
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name='broadcaster')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop after the current page; the broadcast resumes on the next start"""
+        if self.thread is not None:
+            self.stopping = True
+            self.wake.set()
+            self.thread.join()
+            self.thread = None
+
+    def notify(self):
+        """Look for a new broadcast now instead of at the next poll"""
+        self.wake.set()
+
+    def _run(self):
+        while not self.stopping:
+            try:
+                broadcast = self.log.claim()
+                if broadcast is not None:
+                    self._broadcast(broadcast)
+                    continue
+            except Exception as e:
+                logger.error("Broadcast failed: %s", e)
+            self.wake.wait(self.poll_interval)
+            self.wake.clear()
+
+    def _broadcast(self, broadcast):
+        broadcast_id = broadcast['id']
+        tiers = self.tiers if broadcast['target'] == 'all' else (broadcast['target'],)
+        if broadcast['cursor_tier'] in tiers:
+            # Resume after the last finished page
+            tiers = tiers[tiers.index(broadcast['cursor_tier']):]
+            after = broadcast['cursor_user']
+        else:
+            after = None
+        logger.info("Broadcast %d to %s started", broadcast_id, broadcast['target'])
+
+        started = time.monotonic()
+        processed = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='broadcast') as pool:
+            for tier in tiers:
+                while True:
+                    if self.stopping:
+                        self.log.release(broadcast_id)
+                        return
+                    user_ids = self.recipients(tier, after, self.page_size)
+                    if not user_ids:
+                        break
+                    done = self.log.delivered(broadcast_id, user_ids)
+                    todo = [user_id for user_id in user_ids if user_id not in done]
+                    results = []
+                    renewed = time.monotonic()
+                    for result in pool.map(lambda user_id: self._deliver(broadcast, user_id), todo):
+                        results.append(result)
+                        if time.monotonic() - renewed > self.log.lease / 3:
+                            # A slow page must not outlive the lease
+                            self.log.renew(broadcast_id)
+                            renewed = time.monotonic()
+                    processed += len(results)
+                    rate = processed / max(time.monotonic() - started, 1e-6)
+                    if not self.log.checkpoint(broadcast_id, results, tier, user_ids[-1], round(rate, 2)):
+                        logger.info("Broadcast %d cancelled", broadcast_id)
+                        return
+                    after = user_ids[-1]
+                after = None
+
+        self.log.finish(broadcast_id)
+        broadcast = self.log.get(broadcast_id)
+        logger.info("Broadcast %d finished: %d sent, %d failed, %d blocked", broadcast_id,
+                    broadcast['sent'], broadcast['failed'], broadcast['blocked'])
+        if self.on_finished is not None:
+            try:
+                self.on_finished(broadcast)
+            except Exception as e:
+                logger.error("Broadcast summary failed: %s", e)
+
+    def _deliver(self, broadcast, user_id):
+        """(user_id, status, error) after sending the broadcast to one recipient"""
+        with self.bucket_lock:
+            now = time.monotonic()
+            delay = self.bucket.reserve(now) - now
+        if delay > 0:
+            time.sleep(delay)
+        self.log.record(broadcast['id'], user_id, 'sending')
+        try:
+            self.send(self.message(broadcast, user_id))
+            status, error = 'sent', None
+        except Exception as e:
+            # 403: the user blocked the bot or deleted their account
+            status = 'blocked' if getattr(e, 'error_code', None) == 403 else 'failed'
+            error = str(e)[:200]
+        self.log.record(broadcast['id'], user_id, status, error)
+        return user_id, status, error
+
+
+def progress(broadcast):
+    """Delivered count, sends per second and ETA in seconds of a broadcast row"""
+    processed = broadcast['sent'] + broadcast['failed'] + broadcast['blocked']
+    rate = broadcast['rate'] or 0.0
+    remaining = max(broadcast['total'] - processed, 0)
+    eta = remaining / rate if rate and broadcast['state'] == 'running' else None
+    return processed, rate, eta
+
+
+def from_env(tiers, recipients, message, send, on_finished=None):
+    """BroadcastLog and Broadcaster configured from BROADCAST_* variables"""
+    log = BroadcastLog(os.getenv('BROADCASTS_PATH', 'broadcasts.db'))
+    log.load()
+    broadcaster = Broadcaster(
+        log, tiers, recipients, message, send, on_finished,
+        workers=int(os.getenv('BROADCAST_WORKERS', '8')),
+        rate=float(os.getenv('BROADCAST_RATE', '20'))
+    )
+    return log, broadcaster
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# One parsed content file. Readers take catalog.get() once and use that
+# snapshot throughout, so a reload never mixes old and new content.
+Content = namedtuple('Content', ['version', 'packages', 'terms', 'payment'])
+
+PACKAGE_FIELDS = {'name': str, 'price': (int, float), 'summary': list, 'features': list, 'warnings': list}
+# address is the labelled text shown to users, wallet the bare address payments are verified against
+PAYMENT_FIELDS = {'payment_methods': list, 'address': str, 'wallet': str, 'contact_admin': str}
+
+
+def parse(data, tiers):
+    """Validated (packages, terms, payment) from the decoded content file; raises ValueError"""
+    packages = data.get('packages')
+    if not isinstance(packages, dict) or set(packages) != set(tiers):
+        raise ValueError(f"packages must define exactly: {', '.join(tiers)}")
+    for tier in tiers:
+        check_fields(f"packages.{tier}", packages[tier], PACKAGE_FIELDS)
+    if not isinstance(data.get('terms'), str):
+        raise ValueError("terms must be a string")
+    check_fields('payment', data.get('payment'), PAYMENT_FIELDS)
+    # Keep the packages in tier order
+    return {tier: packages[tier] for tier in tiers}, data['terms'], data['payment']
+
+
+def check_fields(name, value, fields):
+    if not isinstance(value, dict):
+        raise ValueError(f"{name} must be an object")
+    for field, kind in fields.items():
+        if not isinstance(value.get(field), kind) or isinstance(value.get(field), bool):
+            raise ValueError(f"{name}.{field} is missing or has the wrong type")
+
+
+class ContentCatalog:
+    """Packages, terms and payment details read from a JSON file.
+
+    The file is parsed once into an immutable Content snapshot that
+    replaces the previous one in a single assignment. check() looks at the
+    file's modification time at most every check_interval seconds and
+    reloads it when it changed, bumping version; a file that fails to
+    parse or validate leaves the current snapshot in place. Caches of
+    rendered content are keyed by the version.
+    """
+
+    def __init__(self, path, tiers, check_interval=2.0):
+        self.path = path
+        self.tiers = tiers
+        self.check_interval = check_interval
+        self.current = None
+        self.mtime = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        if not self.load():
+            raise ValueError(f"Cannot load the content catalog from {path}")
+
+    def load(self, if_changed=False):
+        """Parse the file and swap it in; returns False if it was rejected"""
+        with self.lock:
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if if_changed and mtime == self.mtime:
+                    # Another thread reloaded it meanwhile
+                    return True
+                self.mtime = mtime
+                with open(self.path, encoding='utf-8') as f:
+                    packages, terms, payment = parse(json.load(f), self.tiers)
+            except (OSError, ValueError) as e:
+                logger.error("Keeping the current content, loading %s failed: %s", self.path, e)
+                return False
+            version = self.current.version + 1 if self.current else 1
+            self.current = Content(version, packages, terms, payment)
+        logger.info("Loaded content catalog version %d", version)
+        return True
+
+    def check(self):
+        """Reload the file if it changed; returns the current version"""
+        now = time.monotonic()
+        if now - self.checked >= self.check_interval:
+            self.checked = now
+            try:
+                changed = os.stat(self.path).st_mtime != self.mtime
+            except OSError:
+                changed = False
+            if changed:
+                self.load(if_changed=True)
+        return self.current.version
+
+    def get(self):
+        """The current Content snapshot"""
+        self.check()
+        return self.current
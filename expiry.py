@@ -0,0 +1,110 @@
+import heapq
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    """Revokes time-bounded grants when they expire.
+
+    Grants sit in a min-heap of (expires_at, user_id), so scheduling and
+    popping the next expiry are O(log n) and nothing scans the user base.
+    A renewed or revoked grant leaves a stale entry behind; it is dropped
+    when popped, because expire(user_ids, now) only revokes users whose
+    current expiry has passed and returns [(user_id, tier)] of those it
+    revoked. Grants falling due within batch_delay of each other are
+    revoked in one expire() call, and on_expired gets the revoked users.
+    """
+
+    def __init__(self, expire, on_expired=None, batch_delay=1.0, retry_delay=30):
+        self.expire = expire
+        self.on_expired = on_expired
+        self.batch_delay = batch_delay
+        self.retry_delay = retry_delay
+        self.heap = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+
+    def schedule(self, user_id, expires_at):
+        """Revoke a user's access at expires_at (seconds since the epoch)"""
+        with self.condition:
+            heapq.heappush(self.heap, (expires_at, user_id))
+            if self.heap[0] == (expires_at, user_id):
+                # New earliest expiry, wake the thread to shorten its wait
+                self.condition.notify()
+
+    def start(self, load=None):
+        """Start the scheduler thread; load() returns (user_id, expires_at) pairs to schedule first"""
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, args=(load,), name='expiry-scheduler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread"""
+        if self.thread is not None:
+            with self.condition:
+                self.stopping = True
+                self.condition.notify()
+            self.thread.join()
+            self.thread = None
+            # start() reloads the expiries from the store
+            self.heap = []
+
+    def pending(self):
+        """Number of scheduled expiries, stale entries included"""
+        return len(self.heap)
+
+    def _run(self, load):
+        if load is not None:
+            # Read in this thread so a large store does not delay startup
+            entries = [(expires_at, user_id) for user_id, expires_at in load()]
+            with self.condition:
+                self.heap.extend(entries)
+                heapq.heapify(self.heap)
+            logger.info("Scheduled %d grant expiries", len(entries))
+
+        while True:
+            with self.condition:
+                while not self.stopping:
+                    if self.heap:
+                        wait = self.heap[0][0] - time.time()
+                        if wait <= 0:
+                            break
+                        self.condition.wait(wait)
+                    else:
+                        self.condition.wait()
+                if self.stopping:
+                    return
+
+            # Let grants expiring together join one batch
+            time.sleep(self.batch_delay)
+            now = time.time()
+            with self.condition:
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap)[1])
+            self._revoke(due, now)
+
+    def _revoke(self, user_ids, now):
+        try:
+            revoked = self.expire(user_ids, now)
+        except Exception as e:
+            logger.error("Failed to revoke %d expired grants: %s", len(user_ids), e)
+            for user_id in user_ids:
+                self.schedule(user_id, now + self.retry_delay)
+            return
+
+        if revoked:
+            metrics.GRANTS_EXPIRED.inc(amount=len(revoked))
+            logger.info("Revoked %d expired grants", len(revoked))
+            if self.on_expired is not None:
+                try:
+                    self.on_expired(revoked)
+                except Exception as e:
+                    logger.error("Expiry notification failed: %s", e)
@@ -0,0 +1,50 @@
+"""Gunicorn settings for production: gunicorn -c gunicorn.conf.py bot:app
+
+The webhook is registered once in the master process. Every worker process
+starts its own update queue after the fork and drains it on shutdown. The
+keep-alive ping runs in the workers, which see the inbound traffic.
+"""
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from user_store import web_workers
+
+# bot.py loads .env too, but the settings below are read before it is imported
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+worker_class = 'gthread'
+workers = web_workers()
+threads = int(os.getenv('WEB_THREADS', '8'))
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+# Time given to workers to finish queued updates on SIGTERM
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '20'))
+keepalive = 75
+preload_app = True
+
+if workers < int(os.getenv('WEB_CONCURRENCY', '1')):
+    logging.getLogger('gunicorn.error').warning("USER_STORE=json cannot be shared between processes, using 1 worker")
+
+
+def when_ready(server):
+    import bot
+    try:
+        bot.setup_webhook()
+    except Exception as e:
+        server.log.error(f"Failed to set webhook: {e}")
+
+
+def post_fork(server, worker):
+    import bot
+    # The log writer thread and pooled sockets of the master do not carry over
+    bot.log_pipeline.install()
+    bot.http_session.install()
+    bot.start_workers()
+    bot.start_keep_alive()
+
+
+def worker_exit(server, worker):
+    import bot
+    bot.stop_workers()
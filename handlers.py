@@ -0,0 +1,1089 @@
+"""Bot handlers shared by the sync (bot.py) and async (async_bot.py) runtimes.
+
+Handlers never talk to Telegram themselves. They return the list of Bot
+API calls to make, as ApiCall(method, args, kwargs) using TeleBot method
+names, and the runtime performs them with its own client.
+"""
+import csv
+import io
+import itertools
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import Counter, namedtuple
+
+from telebot import types
+
+import broadcast
+from catalog import ContentCatalog
+import payments
+from expiry import ExpiryScheduler
+from router import CallbackRouter
+from screens import RenderedMessages, ScreenRegistry
+from templates import TemplateLibrary
+from user_store import LazyStore, open_store, web_workers
+
+logger = logging.getLogger(__name__)
+
+# A Bot API call for the runtime to make: getattr(bot, method)(*args, **kwargs)
+ApiCall = namedtuple('ApiCall', ['method', 'args', 'kwargs'])
+
+def api_call(method, *args, **kwargs):
+    """Describe a Bot API call"""
+    return ApiCall(method, args, kwargs)
+
+ADMIN_USERNAME = 'flexxerone'
+
+def is_admin(message):
+    """True if the message comes from the bot admin"""
+    return message.from_user is not None and message.from_user.username == ADMIN_USERNAME
+
+def from_admin(update):
+    """True if a message or button click in the update comes from the bot admin"""
+    event = update.message or update.edited_message or update.callback_query
+    return event is not None and is_admin(event)
+
+def dropped_update(update, reason):
+    """Calls acknowledging an update the ingress filter dropped, so a throttled click stops spinning"""
+    # A duplicate click was answered when its first delivery was handled
+    if update.callback_query and reason == 'throttled':
+        return [api_call('answer_callback_query', update.callback_query.id, "Too many requests, please slow down.")]
+    return []
+
+# Tiers the user stores know, lowest first
+TIERS = ('basic', 'advanced')
+
+# Packages, terms and payment details, reloaded when content.json changes
+catalog = ContentCatalog(
+    os.getenv('CONTENT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content.json')),
+    TIERS
+)
+
+def tier_name(tier):
+    """Display name of a tier's package"""
+    return catalog.get().packages[tier]['name']
+
+# Screen texts compiled from templates/*.txt, reloaded when a file changes
+templates = TemplateLibrary(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+
+# Static screens, rendered once per catalog and template version
+screens = ScreenRegistry(version=lambda: (catalog.check(), templates.check()))
+
+def shares_chats():
+    """True if other processes may handle clicks on the messages this one sent"""
+    return web_workers() > 1 or os.getenv('USER_STORE', 'json') == 'redis'
+
+# What each bot message currently shows, so unchanged edits are skipped. Only
+# when this process sees every click: otherwise another one may have edited
+# the message since, and the edits are always sent. Set by load_users(), once
+# .env has been read.
+rendered = None
+
+# Callback routes, filled in below the screen handlers
+router = CallbackRouter()
+
+# Store users and their tiers, opened by load_users()
+user_store = None
+
+def load_users(lazy=False):
+    """Open the premium user store (JSON replays snapshot plus log); lazy defers it to first use"""
+    global user_store, rendered
+    rendered = None if shares_chats() else RenderedMessages()
+    # Backend: 'json' (snapshot + log file), 'sqlite' (shared by processes on one machine)
+    # or 'redis' (shared by every node; USER_STORE_PATH or REDIS_URL is the server URL)
+    backend = os.getenv('USER_STORE', 'json')
+    path = os.getenv('USER_STORE_PATH')
+    if lazy:
+        user_store = LazyStore(lambda: open_store(backend, path))
+    else:
+        user_store = open_store(backend, path)
+        user_store.load()
+
+# Revokes time-bounded grants once started with start_expirations()
+expirations = ExpiryScheduler(lambda user_ids, now: user_store.expire(user_ids, now))
+
+def start_expirations(deliver):
+    """Start revoking expired grants; deliver(calls) makes the expiry notice calls"""
+    expirations.on_expired = lambda revoked: deliver(expiry_notices(revoked))
+    expirations.start(load=lambda: user_store.expiring())
+
+def expiry_notices(revoked):
+    """Messages telling users their access has expired, one per user for the highest tier lost"""
+    lost = {}
+    for user_id, tier in revoked:
+        if lost.get(user_id) != 'advanced':
+            lost[user_id] = tier
+    calls = []
+    for user_id, tier in lost.items():
+        text = f"Your {tier_name(tier) if tier in TIERS else 'premium'} access has expired."
+        remaining = user_store.get_tier(user_id)
+        if remaining:
+            text += f"\nYou still have {tier_name(remaining)} access."
+        calls.append(api_call('send_message', user_id, text + "\nUse /start to view packages and renew."))
+    return calls
+
+# Pending payments and the poller settling them, when PAYMENT_SOURCE is set
+payment_book = None
+payment_poller = None
+
+def start_payments(deliver):
+    """Start verifying payments automatically; deliver(calls) makes the confirmation calls"""
+    global payment_book, payment_poller
+    payment_book, payment_poller = payments.from_env(
+        lambda matched: deliver(settle_payments(matched)),
+        lambda: catalog.get().payment['wallet']
+    )
+    if payment_poller is not None:
+        payment_poller.start()
+
+def stop_payments():
+    """Stop polling for payments"""
+    if payment_poller is not None:
+        payment_poller.stop()
+
+def settle_payments(matched):
+    """Grant the tiers of matched payments, one batch per tier, and return the confirmations"""
+    by_tier = {}
+    for payment, _ in matched:
+        by_tier.setdefault(payment.tier, []).append(payment.user_id)
+    for tier, user_ids in by_tier.items():
+        grant(user_ids, tier)
+    logger.info("Activated %d paid grants", len(matched))
+    return [
+        api_call('send_message', payment.user_id,
+                 f"Payment of {payments.format_amount(transaction.amount)} USDT received (reference {payment.reference}).\n"
+                 f"Your {tier_name(payment.tier)} access is now active. Use /start to open the menu.")
+        for payment, transaction in matched
+    ]
+
+# Announcements to premium users, sent in the background once started
+broadcast_log = None
+broadcaster = None
+
+def start_broadcasts(send):
+    """Start the broadcast thread; send(call) makes one Bot API call and raises on failure"""
+    global broadcast_log, broadcaster
+    broadcast_log, broadcaster = broadcast.from_env(
+        TIERS,
+        lambda tier, after, limit: user_store.page(tier, after=after, limit=limit),
+        lambda announcement, user_id: api_call('send_message', user_id, announcement['text']),
+        send,
+        lambda finished: send(api_call('send_message', finished['admin_chat'], broadcast_status(finished)))
+    )
+    broadcaster.start()
+
+def stop_broadcasts():
+    """Stop broadcasting after the current page, to resume on the next start"""
+    if broadcaster is not None:
+        broadcaster.stop()
+
+def broadcast_status(announcement):
+    """Progress report of a broadcast row"""
+    processed, rate, eta = broadcast.progress(announcement)
+    lines = [
+        f"Broadcast #{announcement['id']} to {announcement['target']}: {announcement['state']}",
+        f"Processed: {processed}/{announcement['total']}",
+        f"Sent: {announcement['sent']}, failed: {announcement['failed']}, blocked: {announcement['blocked']}",
+        f"Speed: {rate:.1f} sends/s"
+    ]
+    if eta is not None:
+        lines.append(f"ETA: {int(eta) // 60}m {int(eta) % 60}s")
+    return "\n".join(lines)
+
+# Grant durations: /addpremium 123 basic 30d
+DURATION_UNITS = {'d': 86400, 'h': 3600, 'm': 60}
+
+def parse_duration(token):
+    """Seconds in a duration like 30d, 12h or 90m, or None if token is not one"""
+    unit = DURATION_UNITS.get(token[-1:].lower())
+    if unit is None or not token[:-1].isdigit() or int(token[:-1]) == 0:
+        return None
+    return int(token[:-1]) * unit
+
+def format_time(timestamp):
+    """Seconds since the epoch as a UTC date and time"""
+    return time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(timestamp))
+
+def grant(user_ids, tier, duration=None):
+    """Grant a tier to users, for duration seconds if given; returns (previous tiers, expiry time)"""
+    expires_at = time.time() + duration if duration else None
+    previous = user_store.add_many(user_ids, tier, expires_at)
+    if expires_at is not None:
+        for user_id in user_ids:
+            expirations.schedule(user_id, expires_at)
+    return previous, expires_at
+
+def main_menu(user):
+    """Main menu text and keyboard for a user"""
+    # Create inline keyboard
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    
+    buttons = [
+        types.InlineKeyboardButton("Available Solutions", callback_data="solutions"),
+        types.InlineKeyboardButton("Secret Info Packages", callback_data="packages"),
+        types.InlineKeyboardButton("Terms & Conditions", callback_data="terms"),
+        types.InlineKeyboardButton("Contact Admin", callback_data="contact_admin"),
+        types.InlineKeyboardButton("My Access", callback_data="my_account")
+    ]
+    
+    for button in buttons:
+        markup.add(button)
+    
+    # Check user tier
+    user_tier = "No Access"
+    tier = user_store.get_tier(user.id)
+    if tier:
+        user_tier = tier_name(tier)
+    
+    welcome_text = f"""
+Welcome to Secret Info Bot, {user.first_name}!
+
+Your Current Access: {user_tier}
+
+This bot provides exclusive information packages.
+
+Choose an option below to explore what's available.
+
+All secret info requires accepting our terms.
+    """
+    return welcome_text, markup, user_tier
+
+def send_welcome(message):
+    """Handle /start command"""
+    user = message.from_user
+    welcome_text, markup, user_tier = main_menu(user)
+    logger.info("User %s (ID: %s) started - Tier: %s", user.first_name, user.id, user_tier,
+                extra={'event': 'start'})
+    return [api_call('send_message', message.chat.id, welcome_text, reply_markup=markup)]
+
+def add_premium_user(message):
+    """Admin command to add users to premium"""
+    if not is_admin(message):
+        return [api_call('reply_to', message, "Unauthorized access.")]
+    
+    try:
+        parts = message.text.split()
+        if len(parts) not in (3, 4):
+            return [api_call('reply_to', message, "Usage: /addpremium <user_id> <tier> [duration]\nTiers: basic, advanced\nDuration: e.g. 30d, 12h (default: no expiry)")]
+        
+        user_id = parse_user_id(parts[1])
+        tier = parts[2].lower()
+        duration = None
+        if len(parts) == 4:
+            duration = parse_duration(parts[3])
+            if duration is None:
+                return [api_call('reply_to', message, "Invalid duration. Use e.g. 30d, 12h or 90m.")]
+        
+        if tier in TIERS:
+            _, expires_at = grant([user_id], tier, duration)
+            until = f" until {format_time(expires_at)}" if expires_at else ""
+            return [api_call('reply_to', message, f"User {user_id} added to {tier_name(tier)}{until}.")]
+        else:
+            return [api_call('reply_to', message, "Invalid tier. Use: basic, advanced")]
+            
+    except ValueError:
+        return [api_call('reply_to', message, "Invalid user ID. Must be a number.")]
+    except Exception as e:
+        return [api_call('reply_to', message, f"Error: {e}")]
+
+def remove_premium_user(message):
+    """Admin command to remove users from premium"""
+    if not is_admin(message):
+        return [api_call('reply_to', message, "Unauthorized access.")]
+    
+    try:
+        parts = message.text.split()
+        if len(parts) != 2:
+            return [api_call('reply_to', message, "Usage: /removepremium <user_id>")]
+        
+        user_id = parse_user_id(parts[1])
+        
+        user_store.remove(user_id)
+        
+        return [api_call('reply_to', message, f"User {user_id} removed from secret info access.")]
+        
+    except ValueError:
+        return [api_call('reply_to', message, "Invalid user ID. Must be a number.")]
+    except Exception as e:
+        return [api_call('reply_to', message, f"Error: {e}")]
+
+# Most IDs accepted by one bulk command or upload
+MAX_BULK_IDS = 50000
+# Largest uploaded ID list downloaded for a bulk command
+MAX_UPLOAD_BYTES = 1024 * 1024
+
+# Telegram user IDs fit in a signed 64-bit integer, like the store columns
+MAX_USER_ID = 2 ** 63 - 1
+
+def parse_user_id(token):
+    """User ID from a token; raises ValueError if it is not an integer in range"""
+    user_id = int(token)
+    if not -MAX_USER_ID - 1 <= user_id <= MAX_USER_ID:
+        raise ValueError(f"User ID out of range: {token}")
+    return user_id
+
+def parse_user_ids(tokens):
+    """Validate ID tokens in one pass; returns (unique user ids in order, invalid tokens)"""
+    user_ids = {}
+    invalid = []
+    for token in tokens:
+        try:
+            user_ids[parse_user_id(token)] = None
+        except ValueError:
+            invalid.append(token)
+    return list(user_ids), invalid
+
+def upload_tokens(content):
+    """ID tokens from an uploaded file: the first column of each line, skipping a header"""
+    rows = csv.reader(io.StringIO(content.decode('utf-8', errors='replace')))
+    tokens = [row[0].strip() for row in rows if row and row[0].strip()]
+    if tokens and not tokens[0].lstrip('-').isdigit():
+        tokens = tokens[1:]
+    return tokens
+
+def bulk_results(tier, previous, expiring=False):
+    """Per-ID result of a bulk grant (tier given) or revoke (tier None)"""
+    results = {}
+    for user_id, before in previous.items():
+        if tier is None:
+            results[user_id] = 'removed' if before else 'not premium'
+        elif before is None:
+            results[user_id] = 'added'
+        elif before == tier:
+            results[user_id] = 'expiry updated' if expiring else f'already {before}'
+        elif before == 'advanced':
+            # The basic grant is still stored, for when the advanced one lapses
+            results[user_id] = 'already advanced'
+        else:
+            results[user_id] = 'upgraded'
+    return results
+
+def bulk_report(message, title, results, invalid):
+    """Reply with counts and per-ID results, as a CSV document if too long for a message"""
+    counts = Counter(results.values())
+    if invalid:
+        counts['invalid ID'] = len(invalid)
+    summary = f"{title}\n" + "\n".join(f"{result}: {count}" for result, count in counts.items())
+    lines = [f"{user_id}: {result}" for user_id, result in results.items()]
+    lines += [f"{token[:32]}: invalid ID" for token in invalid]
+    report = summary + "\n\n" + "\n".join(lines)
+    if len(report) <= 4000:
+        return [api_call('reply_to', message, report)]
+    
+    rows = itertools.chain(results.items(), ((token, 'invalid ID') for token in invalid))
+    document = csv_document(['user_id', 'result'], rows)
+    return [
+        api_call('reply_to', message, summary),
+        api_call('send_document', message.chat.id, document, visible_file_name='bulk_results.csv')
+    ]
+
+def bulk_apply(message, command, tokens):
+    """Validate the IDs of a bulk command, apply them in one batch and report per ID"""
+    if command == 'bulkadd':
+        if not tokens or tokens[0].lower() not in TIERS:
+            return [api_call('reply_to', message, "Usage: /bulkadd <tier> [duration] <user_id> <user_id> ...\nTiers: basic, advanced\nDuration: e.g. 30d, 12h (default: no expiry)\nOr upload a file of IDs with /bulkadd <tier> [duration] as caption.")]
+        tier = tokens[0].lower()
+        tokens = tokens[1:]
+        duration = parse_duration(tokens[0]) if tokens else None
+        if duration is not None:
+            tokens = tokens[1:]
+    elif command == 'bulkremove':
+        tier = None
+        duration = None
+    else:
+        return [api_call('reply_to', message, "Unknown bulk command. Use /bulkadd or /bulkremove.")]
+    
+    user_ids, invalid = parse_user_ids(tokens)
+    if not user_ids and not invalid:
+        usage = f"/bulkadd {tier}" if tier else "/bulkremove"
+        return [api_call('reply_to', message, f"No user IDs given. Usage: {usage} <user_id> <user_id> ...")]
+    if len(user_ids) > MAX_BULK_IDS:
+        return [api_call('reply_to', message, f"Too many IDs: {len(user_ids)} (max {MAX_BULK_IDS}).")]
+    
+    try:
+        if tier is None:
+            previous = user_store.remove_many(user_ids) if user_ids else {}
+            title = "Bulk remove from secret info access"
+        else:
+            previous, expires_at = grant(user_ids, tier, duration) if user_ids else ({}, None)
+            title = f"Bulk add to {tier_name(tier)}"
+            if expires_at is not None:
+                title += f" until {format_time(expires_at)}"
+    except Exception as e:
+        return [api_call('reply_to', message, f"Error: {e}")]
+    
+    logger.info("%s: %d IDs, %d invalid", title, len(user_ids), len(invalid))
+    return bulk_report(message, title, bulk_results(tier, previous, duration is not None), invalid)
+
+def bulk_command(message):
+    """Admin commands /bulkadd <tier> <ids...> and /bulkremove <ids...>"""
+    if not is_admin(message):
+        return [api_call('reply_to', message, "Unauthorized access.")]
+    
+    # Arguments may start on the next line: split on any whitespace
+    parts = message.text.split(maxsplit=1)
+    command = parts[0].lstrip('/').split('@')[0].lower()
+    arguments = parts[1].strip() if len(parts) > 1 else ''
+    return bulk_apply(message, command, re.split(r'[\s,;]+', arguments) if arguments else [])
+
+def bulk_caption(message):
+    """Bulk command given as the caption of an uploaded document, or None"""
+    parts = (message.caption or '').split()
+    if not parts:
+        return None
+    command = parts[0].lstrip('/').split('@')[0].lower()
+    return command if parts[0].startswith('/') and command in ('bulkadd', 'bulkremove') else None
+
+def is_bulk_upload(message):
+    """Filter for documents sent with /bulkadd or /bulkremove as caption"""
+    return bulk_caption(message) is not None
+
+def accepts_upload(message):
+    """True if the runtime should download the document for bulk_upload"""
+    return is_admin(message) and (message.document.file_size or 0) <= MAX_UPLOAD_BYTES
+
+def bulk_upload(message, content):
+    """Admin bulk command with the IDs in an uploaded file; content is None if not downloaded"""
+    if not is_admin(message):
+        return [api_call('reply_to', message, "Unauthorized access.")]
+    if content is None:
+        return [api_call('reply_to', message, f"File too large (max {MAX_UPLOAD_BYTES // 1024} KB).")]
+    
+    arguments = message.caption.split()[1:]
+    return bulk_apply(message, bulk_caption(message), arguments + upload_tokens(content))
+
+# Users shown per /listpremium page, well under the 4096 character message limit
+LIST_PAGE_SIZE = 50
+
+def list_premium_users(message):
+    """Admin command to list premium users, one page at a time"""
+    if not is_admin(message):
+        return [api_call('reply_to', message, "Unauthorized access.")]
+    
+    parts = message.text.split()
+    tier = parts[1].lower() if len(parts) > 1 else 'basic'
+    if tier not in TIERS:
+        return [api_call('reply_to', message, "Usage: /listpremium [basic|advanced]")]
+    
+    response, markup = premium_page(tier)
+    return [api_call('reply_to', message, response, reply_markup=markup)]
+
+def premium_page(tier, cursor=''):
+    """Text and keyboard for a page of a tier's users.
+
+    cursor is '' for the first page, '>id' for the page after id and '<id'
+    for the page before it. Pages are read from the store by id, so any
+    page costs the same however far into the list it is.
+    """
+    if cursor.startswith('<'):
+        users = user_store.page(tier, before=int(cursor[1:]), limit=LIST_PAGE_SIZE + 1)
+        has_prev = len(users) > LIST_PAGE_SIZE
+        has_next = True
+        users = users[-LIST_PAGE_SIZE:]
+    else:
+        after = int(cursor[1:]) if cursor.startswith('>') else None
+        users = user_store.page(tier, after=after, limit=LIST_PAGE_SIZE + 1)
+        has_prev = after is not None
+        has_next = len(users) > LIST_PAGE_SIZE
+        users = users[:LIST_PAGE_SIZE]
+    
+    user_list = "\n".join([str(uid) for uid in users]) or "None"
+    response = f"""
+{tier_name(tier)} Users ({user_store.count(tier)}):
+{user_list}
+"""
+    
+    markup = types.InlineKeyboardMarkup()
+    buttons = []
+    if users and has_prev:
+        buttons.append(types.InlineKeyboardButton("Prev", callback_data=f"listpremium:{tier}:<{users[0]}"))
+    if users and has_next:
+        buttons.append(types.InlineKeyboardButton("Next", callback_data=f"listpremium:{tier}:>{users[-1]}"))
+    if not users and cursor:
+        buttons.append(types.InlineKeyboardButton("First Page", callback_data=f"listpremium:{tier}"))
+    if buttons:
+        markup.row(*buttons)
+    for other in TIERS:
+        if other != tier:
+            markup.add(types.InlineKeyboardButton(f"{tier_name(other)} Users", callback_data=f"listpremium:{other}"))
+    markup.add(types.InlineKeyboardButton("Export CSV", callback_data="exportpremium"))
+    return response, markup
+
+def csv_document(header, rows):
+    """A CSV file written row by row, rewound and ready to upload"""
+    # Spills to disk past 1 MB so a large file does not sit in memory
+    document = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    text = io.TextIOWrapper(document, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(header)
+    writer.writerows(rows)
+    text.flush()
+    text.detach()
+    document.seek(0)
+    return document
+
+def premium_csv():
+    """Every premium user as a CSV file (user_id, tier), written as the ids stream from the store"""
+    rows = ((user_id, tier) for tier in TIERS for user_id in user_store.iter_users(tier))
+    return csv_document(['user_id', 'tier'], rows)
+
+def show_premium_page(call, param):
+    """Turn a /listpremium page to another page or tier"""
+    if not is_admin(call):
+        return [api_call('answer_callback_query', call.id, "Unauthorized access.")]
+    
+    tier, _, cursor = param.partition(':')
+    if tier not in TIERS:
+        return [api_call('answer_callback_query', call.id, "Invalid tier.")]
+    
+    response, markup = premium_page(tier, cursor)
+    return edit_message(call, response, markup)
+
+def export_premium_users(call):
+    """Send every premium user as a CSV document"""
+    if not is_admin(call):
+        return [api_call('answer_callback_query', call.id, "Unauthorized access.")]
+    
+    return [
+        api_call('answer_callback_query', call.id, "Exporting premium users..."),
+        api_call('send_document', call.message.chat.id, premium_csv(), visible_file_name='premium_users.csv')
+    ]
+
+BROADCAST_USAGE = "Usage: /broadcast <basic|advanced|all> <text>\n/broadcast status\n/broadcast cancel"
+
+def broadcast_command(message):
+    """Admin command to announce to premium users: /broadcast <tier|all> <text>, status or cancel"""
+    if not is_admin(message):
+        return [api_call('reply_to', message, "Unauthorized access.")]
+    if broadcast_log is None:
+        return [api_call('reply_to', message, "Broadcasts are not available.")]
+    
+    parts = message.text.split(maxsplit=2)
+    action = parts[1].lower() if len(parts) > 1 else None
+    if action == 'status':
+        latest = broadcast_log.latest()
+        return [api_call('reply_to', message, broadcast_status(latest) if latest else "No broadcasts yet.")]
+    if action == 'cancel':
+        cancelled = broadcast_log.cancel()
+        response = f"Broadcast #{cancelled} cancelled." if cancelled else "No broadcast is running."
+        return [api_call('reply_to', message, response)]
+    if action not in TIERS + ('all',) or len(parts) < 3:
+        return [api_call('reply_to', message, BROADCAST_USAGE)]
+    
+    tiers = TIERS if action == 'all' else (action,)
+    total = sum(user_store.count(tier) for tier in tiers)
+    broadcast_id = broadcast_log.create(parts[2], action, message.chat.id, total)
+    if broadcast_id is None:
+        return [api_call('reply_to', message, "A broadcast is already running, see /broadcast status.")]
+    broadcaster.notify()
+    logger.info("Broadcast %d to %s queued for %d users", broadcast_id, action, total)
+    return [api_call('reply_to', message, f"Broadcast #{broadcast_id} queued for {total} users.")]
+
+def verify_payment(message):
+    """User sends this to pay for a package: /verify <tier>"""
+    user_id = message.from_user.id
+    user_name = message.from_user.username or message.from_user.first_name
+    
+    if payment_book is None:
+        response = f"""
+Payment Verification
+
+User: {user_name}
+ID: {user_id}
+
+Please contact @flexxerone with:
+1. This user ID: {user_id}
+2. Payment proof (screenshot)
+3. Package purchased (Basic/Advanced)
+
+We will activate your secret info access within 24 hours.
+"""
+        return [api_call('reply_to', message, response)]
+    
+    content = catalog.get()
+    parts = message.text.split()
+    tier = parts[1].lower() if len(parts) > 1 else None
+    if tier not in TIERS:
+        packages = "\n".join(f"/verify {key} - {package['name']} (${package['price']})"
+                              for key, package in content.packages.items())
+        return [api_call('reply_to', message, f"Choose the package you are paying for:\n{packages}")]
+    
+    try:
+        payment = payment_book.open(user_id, tier, content.packages[tier]['price'])
+    except Exception as e:
+        logger.error("Could not open a payment for %s: %s", user_id, e)
+        return [api_call('reply_to', message, "Payment verification is unavailable right now, please try again later.")]
+    
+    response = f"""
+Payment Verification
+
+Package: {content.packages[tier]['name']}
+Send EXACTLY: {payments.format_amount(payment.amount)} USDT
+To: {content.payment['address']}
+Reference: {payment.reference}
+Pay before: {format_time(payment.expires_at)}
+
+The exact amount identifies your payment, so do not round it.
+Your access is activated automatically once the transfer is confirmed.
+"""
+    return [api_call('reply_to', message, response)]
+
+def handle_callback(call):
+    """Handle inline button clicks"""
+    return router.dispatch(call)
+
+def callback_error(call, error):
+    """Reply to a callback whose handling failed"""
+    logger.error("Callback error: %s", error)
+    if call.message and rendered is not None:
+        # The edit may not have reached Telegram
+        rendered.forget((call.message.chat.id, call.message.message_id))
+    return [api_call('answer_callback_query', call.id, "Error occurred, please try again.")]
+
+def is_unchanged_edit(error):
+    """True for Telegram's refusal of an edit that changes nothing, e.g. one another process made"""
+    return 'message is not modified' in str(error)
+
+def route_name(call):
+    """Route a callback belongs to, used to label metrics"""
+    return (call.data or '').partition(':')[0]
+
+def edit_message(call, text, markup):
+    """Edit the callback's message, unless it already shows this text and keyboard"""
+    if not isinstance(markup, str):
+        markup = markup.to_json()
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    if rendered is not None and not rendered.update((chat_id, message_id), text, markup):
+        return []
+    return [api_call('edit_message_text', text, chat_id, message_id, reply_markup=markup)]
+
+def show_screen(call, name):
+    """Edit the callback's message into a cached static screen"""
+    response, markup = screens.get(name)
+    return edit_message(call, response, markup)
+
+@screens.screen('solutions')
+def solutions_screen():
+    """Show available solutions"""
+    response = """
+AVAILABLE SOLUTIONS
+
+Here are solutions to common Telegram issues:
+
+UNBLOCK CHANNELS:
+- Use Telegram Web: web.telegram.org
+- Try Telegram X app from your app store
+- Use a free VPN (Windscribe, ProtonVPN)
+- Ask admin for invite link
+
+SENSITIVE CONTENT ERROR:
+1. Go to Settings > Privacy & Security
+2. Find 'Sensitive Content' 
+3. Disable the filter
+*Note: Not available in all regions
+
+FIND CHANNELS & BOTS:
+- Search: "site:t.me keyword" on Google
+- Use @BotFather to create your own bots
+- Check Telegram directories
+
+SECURITY TIPS:
+- Enable 2FA in Settings
+- Use usernames instead of phone numbers
+- Be careful with third-party apps
+- Regularly check active sessions
+
+BASIC TROUBLESHOOTING:
+- Clear cache in Settings
+- Update Telegram to latest version
+- Restart the app
+- Check internet connection
+
+For exclusive information and advanced methods, check our secret info packages.
+"""
+    
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    buttons = [
+        types.InlineKeyboardButton("Unblock Channels", callback_data="unblock_help"),
+        types.InlineKeyboardButton("Fix Sensitive Content", callback_data="sensitive_help"),
+        types.InlineKeyboardButton("Find Content", callback_data="find_help"),
+        types.InlineKeyboardButton("Security Tips", callback_data="security_help"),
+        types.InlineKeyboardButton("Secret Info Packages", callback_data="packages"),
+        types.InlineKeyboardButton("Main Menu", callback_data="back_main")
+    ]
+    
+    markup.add(buttons[0], buttons[1])
+    markup.add(buttons[2], buttons[3])
+    markup.add(buttons[4])
+    markup.add(buttons[5])
+    
+    return response, markup
+
+@screens.screen('packages')
+def packages_screen():
+    """Show secret info packages"""
+    packages = catalog.get().packages
+    sections = "\n\n".join(
+        f"{package['name'].upper()} - ${package['price']}\n" + "\n".join(f"- {item}" for item in package['summary'])
+        for package in packages.values()
+    )
+    response = f"""
+SECRET INFO PACKAGES
+
+Exclusive information packages available:
+
+{sections}
+
+Both packages require accepting our Terms & Conditions.
+"""
+    
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    buttons = [
+        types.InlineKeyboardButton(f"{package['name']} - ${package['price']}", callback_data=f"pkg:{tier}")
+        for tier, package in packages.items()
+    ]
+    buttons += [
+        types.InlineKeyboardButton("Read Terms First", callback_data="terms"),
+        types.InlineKeyboardButton("Main Menu", callback_data="back_main")
+    ]
+    
+    for button in buttons:
+        markup.add(button)
+    
+    return response, markup
+
+def package_screen(package):
+    """Show detailed information for a specific package"""
+    content = catalog.get()
+    package_data = content.packages[package]
+    # With automatic verification the price alone never matches a payment
+    how_to_pay = templates.get('pay_verify' if payments.enabled() else 'pay_manual').render(
+        tier=package,
+        price=package_data['price'],
+        contact_admin=content.payment['contact_admin']
+    )
+    response = templates.get('package').render(
+        name=package_data['name'],
+        price=package_data['price'],
+        warnings=package_data['warnings'],
+        features=package_data['features'],
+        payment_methods=content.payment['payment_methods'],
+        how_to_pay=how_to_pay
+    )
+    
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Review Terms Again", callback_data="terms"))
+    markup.add(types.InlineKeyboardButton("Back to Packages", callback_data="packages"))
+    markup.add(types.InlineKeyboardButton("Main Menu", callback_data="back_main"))
+    
+    return response, markup
+
+for package in TIERS:
+    screens.register(f"pkg:{package}", lambda package=package: package_screen(package))
+
+# Serialized account keyboards, with and without access
+ACCOUNT_MARKUP = {}
+
+def account_variant(content, user_tier):
+    """Account screen template and keyboard with the per-tier parts filled in"""
+    if user_tier:
+        features = content.packages[user_tier]['features']
+        upsell = ""
+    else:
+        features = ["Available solutions only"]
+        upsell = "\n\nPurchase a secret info package to unlock exclusive information!"
+    template = templates.variant(
+        'account', (content.version, user_tier),
+        features=features[:6],
+        more=f"\n- ... and {len(features)-6} more" if len(features) > 6 else "",
+        upsell=upsell
+    )
+    
+    markup = ACCOUNT_MARKUP.get(bool(user_tier))
+    if markup is None:
+        keyboard = types.InlineKeyboardMarkup()
+        if not user_tier:
+            keyboard.add(types.InlineKeyboardButton("View Packages", callback_data="packages"))
+            keyboard.add(types.InlineKeyboardButton("Read Terms First", callback_data="terms"))
+        keyboard.add(types.InlineKeyboardButton("Main Menu", callback_data="back_main"))
+        markup = ACCOUNT_MARKUP[bool(user_tier)] = keyboard.to_json()
+    return template, markup
+
+def show_my_account(call):
+    """Show user account information"""
+    user = call.from_user
+    user_tier = user_store.get_tier(user.id)
+    content = catalog.get()
+    access = "No Access"
+    if user_tier:
+        access = content.packages[user_tier]['name']
+        expires_at = user_store.expires_at(user.id)
+        if expires_at is not None:
+            access = f"{access} (until {format_time(expires_at)})"
+    
+    template, markup = account_variant(content, user_tier)
+    response = template.render(first_name=user.first_name, user_id=user.id, access=access)
+    return edit_message(call, response, markup)
+
+@screens.screen('unblock_help')
+def unblock_help_screen():
+    """Detailed help for unblocking channels"""
+    response = """
+COMPLETE GUIDE TO UNBLOCK TELEGRAM CHANNELS
+
+Method 1: Use Telegram Web
+- Visit: web.telegram.org
+- Works even when app is blocked
+- No installation needed
+
+Method 2: Telegram X App
+- Download from official app store
+- Different infrastructure
+- Often bypasses blocks
+
+Method 3: Free VPN Services
+- Windscribe (10GB free monthly)
+- ProtonVPN (unlimited free)
+- TurboVPN (mobile app)
+
+Method 4: Proxy Servers
+1. Go to Settings > Data & Storage > Proxy
+2. Add proxy manually
+3. Test connection
+
+Method 5: Ask for Invite
+- Contact channel admin directly
+- Request private invite link
+
+Tip: VPNs are most reliable for consistent access.
+"""
+    
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Back to Solutions", callback_data="solutions"))
+    markup.add(types.InlineKeyboardButton("Main Menu", callback_data="back_main"))
+    
+    return response, markup
+
+@screens.screen('sensitive_help')
+def sensitive_help_screen():
+    """Detailed help for sensitive content"""
+    response = """
+FIX SENSITIVE CONTENT FILTER
+
+Step-by-Step Solution:
+
+1. Open Telegram Settings
+2. Tap 'Privacy and Security'
+3. Scroll to find 'Sensitive Content'
+4. Disable the filter
+
+If option is missing:
+- Your country/region may restrict this
+- Try using a VPN first
+- Some iOS restrictions apply
+
+VPN Method:
+1. Install free VPN (Windscribe/ProtonVPN)
+2. Connect to different country
+3. Restart Telegram
+4. Check if option appears
+
+Alternative Solutions:
+- Use Telegram Web version
+- Try different Telegram client
+
+Safety Note: This filter exists to protect users. Disable responsibly.
+"""
+    
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Back to Solutions", callback_data="solutions"))
+    markup.add(types.InlineKeyboardButton("Main Menu", callback_data="back_main"))
+    
+    return response, markup
+
+@screens.screen('find_help')
+def find_help_screen():
+    """Detailed help for finding content"""
+    response = """
+FIND TELEGRAM CHANNELS & BOTS
+
+Search Methods:
+
+Google Search Tricks:
+- "site:t.me keyword"
+- "telegram channel keyword"
+- "t.me/group keyword"
+
+Telegram Directories:
+- tgdrivel.com
+- telegramchannels.me
+- tgram.io
+
+Bot Discovery:
+- @BotFather - Official bot list
+- @StoreBot - Bot store
+- Search within Telegram: "@botname"
+
+Social Media:
+- Reddit: r/TelegramChannels
+- Twitter: Search "telegram channel"
+
+Networking:
+- Ask in related groups
+- Check bio/links of influencers
+
+Advanced Tips:
+- Use specific keywords
+- Check channel engagement
+- Verify channel authenticity
+"""
+    
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Back to Solutions", callback_data="solutions"))
+    markup.add(types.InlineKeyboardButton("Main Menu", callback_data="back_main"))
+    
+    return response, markup
+
+@screens.screen('security_help')
+def security_help_screen():
+    """Detailed security tips"""
+    response = """
+TELEGRAM SECURITY GUIDE
+
+Essential Security Settings:
+
+Two-Factor Authentication:
+1. Settings > Privacy & Security > 2FA
+2. Set strong password
+3. Save recovery email
+
+Privacy Settings:
+- Phone number: Nobody
+- Last seen: My Contacts  
+- Profile photo: My Contacts
+- Groups: My Contacts
+
+Session Management:
+- Regularly check Active Sessions
+- Terminate unfamiliar sessions
+- Use passcode lock
+
+Safety Practices:
+- Don't click suspicious links
+- Verify sender identity
+- Be careful with files
+- Use official apps only
+
+Channel Safety:
+- Check member count & activity
+- Read channel description
+- Verify admin credibility
+- Avoid too-good-to-be-true offers
+
+Quick Security Check:
+- 2FA enabled
+- Privacy settings configured  
+- Active sessions reviewed
+- Official app used
+"""
+    
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Back to Solutions", callback_data="solutions"))
+    markup.add(types.InlineKeyboardButton("Main Menu", callback_data="back_main"))
+    
+    return response, markup
+
+@screens.screen('terms')
+def terms_screen():
+    """Show terms and conditions"""
+    response = f"""
+TERMS & CONDITIONS - MUST READ
+
+{catalog.get().terms}
+
+BY MAKING ANY PURCHASE, YOU AUTOMATICALLY AGREE TO ALL THESE TERMS.
+
+Continue only if you fully understand and accept these conditions.
+"""
+    
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Continue to Packages", callback_data="packages"))
+    markup.add(types.InlineKeyboardButton("Main Menu", callback_data="back_main"))
+    
+    return response, markup
+
+@screens.screen('contact_admin')
+def contact_admin_screen():
+    """Show admin contact information"""
+    payment = catalog.get().payment
+    response = f"""
+CONTACT ADMIN
+
+For payments, support, or questions:
+
+Admin: {payment['contact_admin']}
+
+Required Information:
+- Your Telegram ID
+- Payment method & proof  
+- Specific issue/question
+
+Response Time: Within 24 hours
+
+Payment Address:
+{payment['address']}
+
+Please read Terms & Conditions before contacting about payments.
+"""
+    
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Secret Info Packages", callback_data="packages"))
+    markup.add(types.InlineKeyboardButton("Terms & Conditions", callback_data="terms"))
+    markup.add(types.InlineKeyboardButton("Main Menu", callback_data="back_main"))
+    
+    return response, markup
+
+def back_to_main(call):
+    """Return to main menu by editing the current message"""
+    # call.message was sent by the bot; the user is the one who clicked
+    welcome_text, markup, user_tier = main_menu(call.from_user)
+    return edit_message(call, welcome_text, markup)
+
+# Callback route table
+for screen in ('solutions', 'packages', 'terms', 'contact_admin',
+               'unblock_help', 'sensitive_help', 'find_help', 'security_help'):
+    router.add(screen, lambda call, screen=screen: show_screen(call, screen))
+router.add('pkg', lambda call, package: show_screen(call, f"pkg:{package}"))
+router.add('my_account', show_my_account)
+router.add('back_main', back_to_main)
+router.add('listpremium', show_premium_page)
+router.add('exportpremium', export_premium_users)
+# Buttons sent before package routes took a parameter
+router.add('basic_info', lambda call: show_screen(call, 'pkg:basic'))
+router.add('advanced_info', lambda call: show_screen(call, 'pkg:advanced'))
+
+def handle_all_messages(message):
+    """Handle all other messages"""
+    return send_welcome(message)
+
+# Message handlers in registration order: (metric kind, metric name, TeleBot filters, handler).
+# 'document' handlers also take the uploaded file's bytes, downloaded by the
+# runtime only if accepts_upload(message), else None.
+MESSAGE_HANDLERS = [
+    ('command', 'start', {'commands': ['start', 'help']}, send_welcome),
+    ('command', 'addpremium', {'commands': ['addpremium']}, add_premium_user),
+    ('command', 'removepremium', {'commands': ['removepremium']}, remove_premium_user),
+    ('command', 'listpremium', {'commands': ['listpremium']}, list_premium_users),
+    ('command', 'bulk', {'commands': ['bulkadd', 'bulkremove']}, bulk_command),
+    ('document', 'bulkupload', {'content_types': ['document'], 'func': is_bulk_upload}, bulk_upload),
+    ('command', 'verify', {'commands': ['verify']}, verify_payment),
+    ('command', 'broadcast', {'commands': ['broadcast']}, broadcast_command),
+    ('message', 'text', {'func': lambda message: True}, handle_all_messages),
+]
+
+def has_route(call):
+    """Filter for the callback query handler"""
+    return router.matches(call.data)
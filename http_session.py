@@ -0,0 +1,78 @@
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+import metrics
+import rate_limiter
+
+# Times a call is retried after a 429 before the error is passed on
+MAX_RETRIES = 3
+
+
+def build_session(pool_size=16):
+    """Create a keep-alive session with a connection pool of the given size"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_size,
+        pool_block=True
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+
+# Shared by every outbound call: Bot API requests and keep-alive pings
+session = None
+limiter = None
+
+
+def install(pool_size=None):
+    """Create the shared session and route all TeleBot API calls through it"""
+    global session, limiter
+    if pool_size is None:
+        # Connections kept open per host; should cover the number of update workers
+        pool_size = int(os.getenv('HTTP_POOL_SIZE', '16'))
+    session = build_session(pool_size)
+    limiter = rate_limiter.from_env()
+    apihelper.session = session
+    # Keep the same session forever instead of recreating it every 10 minutes
+    apihelper.SESSION_TIME_TO_LIVE = None
+    apihelper.CUSTOM_REQUEST_SENDER = send_request
+
+
+def send_request(method, url, **kwargs):
+    """Send a Bot API request through the rate limiter and the shared session"""
+    api_method = url.rsplit('/', 1)[-1]
+    chat_id = (kwargs.get('params') or {}).get('chat_id')
+    if chat_id is not None:
+        delay = limiter.reserve(chat_id)
+        if delay > 0:
+            time.sleep(delay)
+
+    for attempt in range(MAX_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException:
+            metrics.API_ERRORS.inc(api_method, 'network')
+            raise
+        finally:
+            metrics.API_SECONDS.observe(time.perf_counter() - started, api_method)
+        if response.status_code == 200:
+            break
+        metrics.API_ERRORS.inc(api_method, str(response.status_code))
+        if response.status_code != 429 or attempt == MAX_RETRIES:
+            break
+        try:
+            wait = rate_limiter.retry_after(response.json())
+        except ValueError:
+            wait = 1
+        limiter.backoff(wait)
+        time.sleep(wait)
+        rate_limiter.rewind_files(kwargs.get('files'))
+    return response
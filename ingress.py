@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from rate_limiter import TokenBucket
+
+
+class IngressFilter:
+    """Drops duplicate and abusive webhook updates before they reach a handler.
+
+    - Updates whose update_id was seen recently are Telegram redeliveries.
+    - Each user gets a token bucket for messages and button clicks.
+    - A message repeating the user's previous text within repeat_window
+      seconds is coalesced into the first one.
+
+    All state is kept in bounded LRU maps, so memory does not grow with
+    traffic. exempt(update) can let some senders (the admin) through.
+    """
+
+    def __init__(self, seen_size=10000, user_rate=1, user_burst=5,
+                 repeat_window=10, max_users=10000, exempt=None):
+        self.seen = OrderedDict()
+        self.seen_size = seen_size
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.repeat_window = repeat_window
+        self.max_users = max_users
+        self.exempt = exempt
+        self.buckets = OrderedDict()
+        self.last_text = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check(self, update):
+        """Why the update should be dropped ('duplicate', 'repeat' or 'throttled'), or None to handle it"""
+        reason = self._reason(update)
+        if reason is not None:
+            metrics.INGRESS_DROPPED.inc(reason)
+        return reason
+
+    def _reason(self, update):
+        now = time.monotonic()
+        with self.lock:
+            if update.update_id in self.seen:
+                self.seen.move_to_end(update.update_id)
+                return 'duplicate'
+            self.seen[update.update_id] = True
+            if len(self.seen) > self.seen_size:
+                self.seen.popitem(last=False)
+
+            message, sender = self._sender(update)
+            if sender is None:
+                return None
+
+            if message is not None and message.text:
+                last = self.last_text.get(sender.id)
+                if last is not None and last[0] == message.text and now - last[1] < self.repeat_window:
+                    return 'repeat'
+                self._remember(self.last_text, sender.id, (message.text, now))
+
+            bucket = self.buckets.get(sender.id)
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._remember(self.buckets, sender.id, bucket)
+            if not bucket.try_acquire(now):
+                return 'throttled'
+        return None
+
+    def forget(self, update):
+        """Undo check() for an update that was not queued, so its redelivery gets in"""
+        with self.lock:
+            self.seen.pop(update.update_id, None)
+            message, sender = self._sender(update)
+            if sender is None:
+                return
+            last = self.last_text.get(sender.id)
+            if message is not None and last is not None and last[0] == message.text:
+                del self.last_text[sender.id]
+            bucket = self.buckets.get(sender.id)
+            if bucket is not None:
+                bucket.refund()
+
+    def _sender(self, update):
+        """(message, sender) of an update; sender is None if it is not filtered per user"""
+        message = update.message or update.edited_message
+        sender = message.from_user if message else None
+        if update.callback_query:
+            sender = update.callback_query.from_user
+        if self.exempt is not None and self.exempt(update):
+            sender = None
+        return message, sender
+
+    def _remember(self, lru, key, value):
+        lru[key] = value
+        lru.move_to_end(key)
+        if len(lru) > self.max_users:
+            lru.popitem(last=False)
+
+
+def from_env(exempt=None):
+    """Build the ingress filter from INGRESS_* environment variables"""
+    return IngressFilter(
+        seen_size=int(os.getenv('INGRESS_SEEN_SIZE', '10000')),
+        user_rate=float(os.getenv('INGRESS_USER_RATE', '1')),
+        user_burst=int(os.getenv('INGRESS_USER_BURST', '5')),
+        repeat_window=float(os.getenv('INGRESS_REPEAT_WINDOW', '10')),
+        exempt=exempt
+    )
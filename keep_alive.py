@@ -0,0 +1,98 @@
+import os
+import random
+import time
+
+import metrics
+
+
+class KeepAlive:
+    """Decides when to ping the public URL so a sleeping host stays awake.
+
+    The host puts the app to sleep after idle_threshold seconds without
+    inbound traffic. touch() is called for every inbound request and a
+    ping is only due once the app has been idle for idle_threshold - margin
+    seconds, so no ping goes out while real traffic keeps it awake. A failed
+    ping is retried after an exponential backoff with jitter. The runtimes
+    make the requests themselves and report the outcome with record().
+    """
+
+    def __init__(self, url, idle_threshold=900, margin=120, retry_base=5, retry_max=120):
+        self.url = url
+        self.idle_threshold = idle_threshold
+        self.ping_after = max(idle_threshold - margin, 1)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.started = time.monotonic()
+        self.last_seen = self.started
+        self.last_ping = None
+        self.last_result = None
+        self.failures = 0
+        self.pings = 0
+        self.failed = 0
+        self.skipped = 0
+        self.next_ping = self.started + self.ping_after
+
+    def touch(self):
+        """Note an inbound request"""
+        self.last_seen = time.monotonic()
+
+    def next_ping_in(self):
+        """Seconds to sleep before checking whether a ping is due"""
+        now = time.monotonic()
+        if self.failures:
+            backoff = min(self.retry_max, self.retry_base * 2 ** (self.failures - 1))
+            delay = backoff / 2 + random.uniform(0, backoff / 2)
+        else:
+            delay = max(self.last_seen + self.ping_after - now, 1.0)
+        self.next_ping = now + delay
+        return delay
+
+    def should_ping(self):
+        """True if the app has been idle long enough to need a ping"""
+        if time.monotonic() - self.last_seen >= self.ping_after:
+            return True
+        # Inbound traffic kept the app awake since the last check
+        self.skipped += 1
+        metrics.KEEP_ALIVE_PINGS.inc('skipped')
+        self.failures = 0
+        return False
+
+    def record(self, status, error=None):
+        """Record the outcome of a ping: the HTTP status, or None and the error"""
+        now = time.monotonic()
+        self.last_ping = now
+        self.last_result = status if error is None else str(error)
+        if status == 200:
+            self.pings += 1
+            self.failures = 0
+            self.last_seen = now
+            metrics.KEEP_ALIVE_PINGS.inc('ok')
+        else:
+            self.failed += 1
+            self.failures += 1
+            metrics.KEEP_ALIVE_PINGS.inc('failed')
+
+    def state(self):
+        """Keep-alive state for the health endpoint"""
+        now = time.monotonic()
+        return {
+            'uptime_seconds': round(now - self.started, 1),
+            'idle_seconds': round(now - self.last_seen, 1),
+            'idle_threshold': self.idle_threshold,
+            'next_ping_in': round(max(self.next_ping - now, 0), 1),
+            'last_ping_ago': round(now - self.last_ping, 1) if self.last_ping is not None else None,
+            'last_result': self.last_result,
+            'consecutive_failures': self.failures,
+            'pings': self.pings,
+            'failed_pings': self.failed,
+            'skipped_pings': self.skipped
+        }
+
+
+def from_env(url):
+    """Build the keep-alive scheduler from KEEP_ALIVE_* environment variables"""
+    return KeepAlive(
+        url,
+        idle_threshold=int(os.getenv('KEEP_ALIVE_IDLE_THRESHOLD', '900')),
+        margin=int(os.getenv('KEEP_ALIVE_MARGIN', '120'))
+    )
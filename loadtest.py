@@ -0,0 +1,394 @@
+"""Load test: replay synthetic Telegram updates against /webhook.
+
+Starts the sync bot (bot.py) in this process with its Bot API pointed at
+a local fake server, then posts streams of updates to /webhook over HTTP
+the way Telegram would. The fake server records every call per method
+and can add latency and answer a share of calls with 429. Latency is
+measured per update, from the POST until its handler returned, so it
+covers the ingress filter, the queue, the handlers, the outbound rate
+limiter and 429 retries.
+
+Scenarios:
+  start     /start from many users
+  navigate  users clicking through the menus (callback queries)
+  admin     /addpremium, /removepremium and /listpremium from the admin
+  mixed     all of the above, mostly navigation
+
+All admin updates come from one chat, so the admin scenario is held to
+OUTBOUND_CHAT_RATE replies per second and sends --admin-updates only.
+The bot's own settings (WEBHOOK_WORKERS, OUTBOUND_*, INGRESS_*) are read
+from the environment as usual. The user store lives in a temporary
+directory and the bot token is fake, so nothing reaches Telegram or the
+real premium_users.json.
+
+Usage: python loadtest.py [--scenarios start,navigate,admin,mixed]
+                          [--updates 500] [--admin-updates 30] [--users 200]
+                          [--concurrency 16] [--latency-ms 30] [--rate-429 0.01]
+                          [--retry-after 0.5]
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+ADMIN_ID = 1
+FIRST_USER_ID = 10000
+
+# Screens reachable from each screen, as callback data
+NAVIGATION = {
+    'back_main': ['solutions', 'packages', 'my_account', 'terms', 'contact_admin'],
+    'solutions': ['unblock_help', 'sensitive_help', 'find_help', 'security_help', 'back_main'],
+    'packages': ['pkg:basic', 'pkg:advanced', 'back_main'],
+    'terms': ['packages', 'back_main'],
+    'my_account': ['packages', 'back_main'],
+    'contact_admin': ['back_main'],
+    'pkg:basic': ['packages', 'back_main'],
+    'pkg:advanced': ['packages', 'back_main']
+}
+for _screen in ('unblock_help', 'sensitive_help', 'find_help', 'security_help'):
+    NAVIGATION[_screen] = ['solutions', 'packages', 'back_main']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeBotApi:
+    """Local stand-in for api.telegram.org that records the calls it gets"""
+
+    def __init__(self, latency=0.0, rate_429=0.0, retry_after=0.5):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.message_ids = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever, name='fake-bot-api')
+        thread.daemon = True
+        thread.start()
+
+    def reset(self):
+        """Counters for the next scenario"""
+        with self.lock:
+            calls, throttled = self.calls, self.throttled
+            self.calls = Counter()
+            self.throttled = 0
+        return calls, throttled
+
+    def respond(self, method, params):
+        """(status, body) for a Bot API call"""
+        if self.latency:
+            time.sleep(random.uniform(self.latency / 2, self.latency * 1.5))
+        with self.lock:
+            self.calls[method] += 1
+            throttled = random.random() < self.rate_429
+            if throttled:
+                self.throttled += 1
+            self.message_ids += 1
+            message_id = self.message_ids
+        if throttled:
+            return 429, {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}
+            }
+        return 200, {'ok': True, 'result': self.result(method, params, message_id)}
+
+    def result(self, method, params, message_id):
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            chat_id = int(params.get('chat_id', 0))
+            message = {
+                'message_id': int(params.get('message_id', message_id)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', '')
+            }
+            if method == 'sendDocument':
+                message['document'] = {'file_id': 'doc', 'file_unique_id': 'doc'}
+            return message
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Load Test', 'username': 'loadtest_bot'}
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_call(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if body and self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+                status, payload = api.respond(method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = handle_call
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def sender(user_id, admin=False):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+    if admin:
+        user['username'] = 'flexxerone'
+    return user
+
+
+def message_update(user_id, text, admin=False):
+    return {
+        'message': {
+            'message_id': random.randint(1, 10 ** 6),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': sender(user_id, admin),
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        }
+    }
+
+
+def callback_update(user_id, data):
+    return {
+        'callback_query': {
+            'id': str(random.randint(1, 10 ** 12)),
+            'data': data,
+            'chat_instance': str(user_id),
+            'from': sender(user_id),
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'menu'
+            }
+        }
+    }
+
+
+class Traffic:
+    """Generates the updates of each scenario"""
+
+    def __init__(self, users):
+        self.users = [FIRST_USER_ID + index for index in range(users)]
+        # Screen each user is looking at
+        self.screens = {}
+
+    def start(self):
+        user_id = random.choice(self.users)
+        self.screens[user_id] = 'back_main'
+        return message_update(user_id, '/start')
+
+    def navigate(self):
+        user_id = random.choice(self.users)
+        screen = random.choice(NAVIGATION[self.screens.get(user_id, 'back_main')])
+        self.screens[user_id] = screen
+        return callback_update(user_id, screen)
+
+    def admin(self):
+        user_id = random.choice(self.users)
+        command = random.choices(
+            [f'/addpremium {user_id} basic', f'/addpremium {user_id} advanced 7d',
+             f'/removepremium {user_id}', '/listpremium', '/listpremium advanced'],
+            weights=[4, 2, 2, 1, 1]
+        )[0]
+        return message_update(ADMIN_ID, command, admin=True)
+
+    def mixed(self):
+        kind = random.choices(['navigate', 'start', 'admin'], weights=[75, 23, 2])[0]
+        return getattr(self, kind)()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(bot, api, url, updates, concurrency, timeout=120):
+    """Post the updates and wait for the bot to handle them"""
+    posted = {}
+    done = {}
+    statuses = Counter()
+    http_times = []
+    lock = threading.Lock()
+    pending = list(reversed(updates))
+
+    queue_before = bot.update_queue.stats()
+    dropped_before = dict(bot.metrics.INGRESS_DROPPED.values)
+
+    def post():
+        session = requests.Session()
+        while True:
+            with lock:
+                if not pending:
+                    return
+                update = pending.pop()
+            started = time.perf_counter()
+            posted[update['update_id']] = started
+            try:
+                status = session.post(url, json=update, timeout=30).status_code
+            except requests.RequestException:
+                status = 'error'
+            with lock:
+                statuses[status] += 1
+                http_times.append(time.perf_counter() - started)
+
+    original = bot.update_queue.handler
+
+    def handler(update):
+        try:
+            original(update)
+        finally:
+            done[update.update_id] = time.perf_counter()
+
+    bot.update_queue.handler = handler
+    started = time.perf_counter()
+    clients = [threading.Thread(target=post) for _ in range(concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    # Wait for the queue to drain
+    deadline = time.monotonic() + timeout
+    drained = False
+    while not drained and time.monotonic() < deadline:
+        stats = bot.update_queue.stats()
+        drained = stats['processed'] - queue_before['processed'] >= stats['enqueued'] - queue_before['enqueued']
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    bot.update_queue.handler = original
+
+    dropped = Counter()
+    for labels, value in bot.metrics.INGRESS_DROPPED.values.items():
+        if value > dropped_before.get(labels, 0):
+            dropped[labels[0]] = value - dropped_before.get(labels, 0)
+    latencies = sorted(done[update_id] - posted[update_id] for update_id in done if update_id in posted)
+    http_times.sort()
+    calls, throttled = api.reset()
+    stats = bot.update_queue.stats()
+    return {
+        'sent': len(updates),
+        'handled': len(latencies),
+        'failed': stats['failed'] - queue_before['failed'],
+        'dropped': sum(dropped.values()),
+        'drop_reasons': dropped,
+        'busy': statuses[503],
+        'errors': statuses['error'],
+        'seconds': elapsed,
+        'drained': drained,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'http_p99': percentile(http_times, 0.99),
+        'calls': calls,
+        'throttled': throttled
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay synthetic updates against /webhook')
+    parser.add_argument('--scenarios', default='start,navigate,admin,mixed')
+    parser.add_argument('--updates', type=int, default=500, help='updates per scenario')
+    parser.add_argument('--admin-updates', type=int, default=30, help='updates in the admin scenario')
+    parser.add_argument('--users', type=int, default=200, help='distinct users sending updates')
+    parser.add_argument('--concurrency', type=int, default=16, help='parallel webhook connections')
+    parser.add_argument('--latency-ms', type=float, default=30, help='mean fake Bot API latency')
+    parser.add_argument('--rate-429', type=float, default=0.01, help='share of calls answered with 429')
+    parser.add_argument('--retry-after', type=float, default=0.5, help='retry_after sent with a 429')
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.latency_ms / 1000, args.rate_429, args.retry_after)
+    api.start()
+
+    # bot.py reads its configuration at import time; everything it writes
+    # goes to a temporary directory, whatever .env says
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    os.environ['BOT_TOKEN'] = '123456:LOADTEST'
+    os.environ['PORT'] = str(free_port())
+    os.environ['USER_STORE'] = 'json'
+    os.environ['USER_STORE_PATH'] = os.path.join(workdir, 'users.json')
+    os.environ['PAYMENT_SOURCE'] = 'manual'
+    os.environ['PAYMENTS_PATH'] = os.path.join(workdir, 'payments.db')
+    os.environ['BROADCASTS_PATH'] = os.path.join(workdir, 'broadcasts.db')
+    from telebot import apihelper
+    import logging
+    import bot
+    apihelper.API_URL = f'http://127.0.0.1:{api.port}/bot{{0}}/{{1}}'
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = bot.start_flask_server()
+    bot.start_workers()
+    url = f'http://127.0.0.1:{bot.PORT}/webhook'
+
+    traffic = Traffic(args.users)
+    print(f"{args.updates} updates per scenario, {args.users} users, {args.concurrency} connections, "
+          f"{bot.WEBHOOK_WORKERS} workers, {args.latency_ms:.0f} ms API latency, "
+          f"{args.rate_429:.1%} 429s")
+    print(f"{'scenario':<10} {'sent':>6} {'handled':>8} {'dropped':>8} {'busy':>5} {'updates/s':>10} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'http p99':>9} {'calls':>6} {'429s':>5}")
+    update_id = 0
+    reports = []
+    for scenario in args.scenarios.split(','):
+        generate = getattr(traffic, scenario)
+        updates = []
+        for _ in range(args.admin_updates if scenario == 'admin' else args.updates):
+            update_id += 1
+            update = generate()
+            update['update_id'] = update_id
+            updates.append(update)
+        result = run(bot, api, url, updates, args.concurrency)
+        reports.append((scenario, result))
+        print(f"{scenario:<10} {result['sent']:>6} {result['handled']:>8} {result['dropped']:>8} "
+              f"{result['busy']:>5} {result['handled'] / result['seconds']:>10.1f} "
+              f"{result['p50'] * 1000:>8.1f} {result['p95'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} "
+              f"{result['http_p99'] * 1000:>9.1f} {sum(result['calls'].values()):>6} {result['throttled']:>5}")
+
+    print()
+    for scenario, result in reports:
+        calls = ', '.join(f"{method} {count}" for method, count in result['calls'].most_common())
+        print(f"{scenario:<10} calls: {calls or 'none'}")
+        if result['drop_reasons']:
+            reasons = ', '.join(f"{reason} {count}" for reason, count in result['drop_reasons'].most_common())
+            print(f"{'':<10} dropped: {reasons}")
+        if not result['drained']:
+            print(f"{'':<10} timed out before the queue drained")
+        if result['failed'] or result['errors']:
+            print(f"{'':<10} handler failures {result['failed']}, webhook errors {result['errors']}")
+
+    server.shutdown()
+    bot.stop_workers()
+
+
+if __name__ == '__main__':
+    main()
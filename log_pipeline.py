@@ -0,0 +1,182 @@
+"""Structured logging that keeps log I/O off the request path.
+
+install() replaces the root handlers with a QueueHandler: a log call only
+stamps the record with the current update's fields and puts it on a
+bounded in-memory queue. A background QueueListener thread formats the
+message (the %-style arguments are only interpolated there) and writes
+it to stdout as one JSON object per line. When the queue is full the
+record is dropped and counted instead of blocking the caller.
+
+Records logged while an update is handled carry its update_id, chat_id
+and route; the 'update' event logged when it finishes adds latency_ms.
+Events listed in LOG_SAMPLE are sampled, e.g. LOG_SAMPLE=update=0.1
+keeps one in ten; warnings and errors are always kept.
+
+Arguments are formatted later on another thread, so pass values that do
+not change afterwards (numbers, strings), not objects still being mutated.
+"""
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+import metrics
+
+logger = logging.getLogger('updates')
+
+# Fields of the update being handled in this thread or task
+_update = contextvars.ContextVar('update', default=None)
+
+# Record attributes copied into the JSON output when set
+FIELDS = ('update_id', 'chat_id', 'route', 'event', 'latency_ms', 'sample_rate')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+DROPPED = metrics.Counter('bot_log_dropped_total', 'Log records dropped because the log queue was full')
+
+listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the fields of the update being handled"""
+
+    def filter(self, record):
+        fields = _update.get()
+        if fields is not None:
+            for field in ('update_id', 'chat_id', 'route'):
+                if getattr(record, field, None) is None:
+                    setattr(record, field, fields[field])
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a share of the records of high-volume events"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, 'event', None))
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        record.sample_rate = rate
+        return random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full"""
+
+    def prepare(self, record):
+        # Formatting happens in the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+def parse_rates(text):
+    """{'update': 0.1} from 'update=0.1'"""
+    rates = {}
+    for item in text.split(','):
+        event, _, rate = item.partition('=')
+        if event.strip() and rate.strip():
+            rates[event.strip()] = float(rate)
+    return rates
+
+
+def install(level=logging.INFO):
+    """Route all logging through the queue and start the writer thread.
+
+    Call again in a forked child, the writer thread does not survive a fork.
+    """
+    global listener
+    stream = logging.StreamHandler(sys.stdout)
+    if os.getenv('LOG_FORMAT', 'json') == 'json':
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter(parse_rates(os.getenv('LOG_SAMPLE', 'update=0.1'))))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    # TeleBot writes to stderr itself; send its records through the queue too
+    logging.getLogger('TeleBot').handlers = []
+
+    listener = logging.handlers.QueueListener(log_queue, stream)
+    listener.start()
+
+
+def shutdown():
+    """Write out the queued records and stop the writer thread"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(shutdown)
+
+
+def describe(update):
+    """Route of an update: the command, the callback route or the content type"""
+    message = update.message or update.edited_message
+    if message is not None and message.text and message.text.startswith('/'):
+        return message.text.split()[0][1:].split('@')[0]
+    if update.callback_query is not None:
+        return (update.callback_query.data or '').partition(':')[0]
+    if message is not None and message.content_type != 'text':
+        return message.content_type
+    return None
+
+
+@contextlib.contextmanager
+def update_context(update, chat_id):
+    """Tag records logged inside with the update, then log its latency"""
+    token = _update.set({'update_id': update.update_id, 'chat_id': chat_id, 'route': describe(update)})
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        logger.info('Update %s', 'failed' if failed else 'handled',
+                    extra={'event': 'update', 'latency_ms': latency_ms})
+        _update.reset(token)
@@ -0,0 +1,154 @@
+import functools
+import threading
+import time
+
+# Latency buckets in seconds, from a cached screen edit to a slow Bot API call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.label_names, labels)} {value}'
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name, help_text, getter, kind='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.getter = getter
+        self.kind = kind
+        REGISTRY.append(self)
+
+    def samples(self):
+        yield f'{self.name} {self.getter()}'
+
+
+class Histogram:
+    """Cumulative histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {labels: dict(series, counts=list(series['counts'])) for labels, series in self.values.items()}
+        for labels, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f'{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}'
+            le = 'le="+Inf"'
+            yield f'{self.name}_bucket{_labels(self.label_names, labels, le)} {series["count"]}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {series["sum"]}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {series["count"]}'
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help_text}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+HANDLER_SECONDS = Histogram(
+    'bot_handler_seconds', 'Time spent in update handlers', labels=('kind', 'handler'))
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors_total', 'Update handlers that raised', labels=('kind', 'handler'))
+API_SECONDS = Histogram(
+    'bot_api_request_seconds', 'Telegram Bot API call latency', labels=('method',))
+API_ERRORS = Counter(
+    'bot_api_errors_total', 'Failed Telegram Bot API calls', labels=('method', 'status'))
+UPDATES = Counter(
+    'bot_updates_total', 'Webhook updates received', labels=('type',))
+INGRESS_DROPPED = Counter(
+    'bot_ingress_dropped_total', 'Webhook updates dropped before any handler', labels=('reason',))
+OUTBOUND_THROTTLED = Counter(
+    'bot_outbound_throttled_total', 'Bot API calls delayed by the rate limiter')
+OUTBOUND_DELAY = Histogram(
+    'bot_outbound_delay_seconds', 'Time Bot API calls waited for the rate limiter')
+OUTBOUND_RETRY_AFTER = Counter(
+    'bot_outbound_retry_after_total', 'Bot API 429 responses honored with retry_after')
+KEEP_ALIVE_PINGS = Counter(
+    'bot_keep_alive_pings_total', 'Keep-alive checks by outcome', labels=('result',))
+GRANTS_EXPIRED = Counter(
+    'bot_grants_expired_total', 'Time-bounded grants revoked on expiry')
+PAYMENTS = Counter(
+    'bot_payments_total', 'Incoming transfers by outcome', labels=('result',))
+
+
+def observe_handler(kind, handler, elapsed, failed=False):
+    """Record one handler run"""
+    HANDLER_SECONDS.observe(elapsed, kind, handler)
+    if failed:
+        HANDLER_ERRORS.inc(kind, handler)
+
+
+def timed(kind, handler):
+    """Decorator recording the latency of an update handler"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                observe_handler(kind, handler, time.perf_counter() - started, failed)
+        return wrapper
+    return decorator
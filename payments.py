@@ -0,0 +1,415 @@
+"""Automatic payment verification.
+
+/verify <tier> opens a pending payment with an expected amount that no
+other open payment uses: the package price plus 0.0001 to 0.9999 USDT.
+A PaymentPoller fetches incoming transfers from a transaction source in
+batches and PaymentBook.claim() matches them against the pending
+payments, by reference when the transfer carries one and otherwise by
+the exact amount. The payments matched in one batch are settled together,
+so their grants are written in one store write per tier.
+
+A transaction source has a name, fetch(cursor, limit), which returns
+(transactions, next_cursor) for up to limit transfers after cursor, and
+start(), the cursor a source polled for the first time begins at: only
+transfers made from then on are read. PAYMENT_SOURCE picks one: manual
+(no automatic verification), fake (FakeLedger, a local JSON-lines file)
+or trongrid (USDT TRC20 transfers to the wallet users are told to pay).
+
+Add a transfer to the fake ledger with:
+    python payments.py <amount> [reference]
+"""
+import json
+import logging
+import os
+import random
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+import requests
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# USDT amounts are integers of 1/1000000 USDT, the TRC20 token precision
+UNIT = 1000000
+# The expected amount is the price plus a multiple of 0.0001 USDT
+OFFSET_STEP = 100
+OFFSET_SLOTS = 9999
+
+Transaction = namedtuple('Transaction', ['txid', 'amount', 'reference', 'timestamp'])
+Payment = namedtuple('Payment', ['reference', 'user_id', 'tier', 'amount', 'created_at', 'expires_at'])
+
+
+def to_units(amount):
+    """Integer units of an amount in USDT, e.g. '15.0137' -> 15013700"""
+    return int(Decimal(str(amount)) * UNIT)
+
+
+def format_amount(units):
+    """USDT text of an amount in units, e.g. 15013700 -> '15.0137'"""
+    whole, fraction = divmod(units, UNIT)
+    return f"{whole}.{fraction:06d}".rstrip('0').rstrip('.')
+
+
+class PaymentBook:
+    """Pending payments and processed transfers in an SQLite database.
+
+    A unique index on amount keeps every open payment's amount distinct,
+    so a transfer matches at most one of them; reference is the primary
+    key. Transfers are recorded by txid before they are matched, and a
+    pending payment is claimed with DELETE ... RETURNING, so a transfer is
+    settled once even when several worker processes poll the same source.
+    A transfer only settles a payment opened before it was made.
+    Payments stay claimable for window seconds and are purged keep
+    seconds after that.
+    """
+
+    def __init__(self, path='payments.db', window=7200, keep=86400):
+        self.path = path
+        self.window = window
+        self.keep = keep
+        self.local = threading.local()
+
+    def load(self):
+        """Create the schema"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS pending ('
+                'reference TEXT PRIMARY KEY, '
+                'user_id INTEGER NOT NULL, '
+                'tier TEXT NOT NULL, '
+                'amount INTEGER NOT NULL, '
+                'created_at REAL NOT NULL, '
+                'expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS pending_amount ON pending (amount)')
+            conn.execute('CREATE INDEX IF NOT EXISTS pending_user ON pending (user_id, tier)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS transactions ('
+                'txid TEXT PRIMARY KEY, '
+                'amount INTEGER NOT NULL, '
+                'reference TEXT, '
+                'timestamp REAL, '
+                'user_id INTEGER, '
+                'tier TEXT)'
+            )
+            conn.execute('CREATE TABLE IF NOT EXISTS cursors (source TEXT PRIMARY KEY, cursor TEXT NOT NULL)')
+
+    def open(self, user_id, tier, price):
+        """The user's open payment for a tier, or a new one with a free amount"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM pending WHERE expires_at < ?', (now - self.keep,))
+            row = conn.execute(
+                'SELECT * FROM pending WHERE user_id = ? AND tier = ? AND expires_at > ?',
+                (user_id, tier, now)
+            ).fetchone()
+        if row is not None:
+            return Payment(*row)
+
+        base = to_units(price)
+        for _ in range(20):
+            payment = Payment(
+                secrets.token_hex(4).upper(), user_id, tier,
+                base + random.randint(1, OFFSET_SLOTS) * OFFSET_STEP, now, now + self.window
+            )
+            try:
+                with conn:
+                    conn.execute('INSERT INTO pending VALUES (?, ?, ?, ?, ?, ?)', payment)
+                return payment
+            except sqlite3.IntegrityError:
+                # Amount or reference taken, draw again
+                continue
+        raise RuntimeError("No free payment amount, try again later")
+
+    def claim(self, transactions):
+        """Match transfers to pending payments; returns ([(payment, transaction)], unmatched transactions)"""
+        matched = []
+        unmatched = []
+        conn = self._conn()
+        with conn:
+            for transaction in transactions:
+                inserted = conn.execute(
+                    'INSERT OR IGNORE INTO transactions (txid, amount, reference, timestamp) VALUES (?, ?, ?, ?)',
+                    (transaction.txid, transaction.amount, transaction.reference, transaction.timestamp)
+                ).rowcount
+                if not inserted:
+                    # Seen in an earlier poll or by another process
+                    continue
+                row = None
+                if transaction.reference:
+                    row = conn.execute(
+                        'DELETE FROM pending WHERE reference = ? AND amount <= ? '
+                        'AND created_at <= ? AND expires_at >= ? RETURNING *',
+                        (transaction.reference.upper(), transaction.amount, transaction.timestamp,
+                         transaction.timestamp)
+                    ).fetchone()
+                if row is None:
+                    row = conn.execute(
+                        'DELETE FROM pending WHERE amount = ? AND created_at <= ? AND expires_at >= ? RETURNING *',
+                        (transaction.amount, transaction.timestamp, transaction.timestamp)
+                    ).fetchone()
+                if row is None:
+                    unmatched.append(transaction)
+                    continue
+                payment = Payment(*row)
+                conn.execute(
+                    'UPDATE transactions SET user_id = ?, tier = ? WHERE txid = ?',
+                    (payment.user_id, payment.tier, transaction.txid)
+                )
+                matched.append((payment, transaction))
+        return matched, unmatched
+
+    def cursor(self, source):
+        """Where polling of a source continues, or None if it was never polled"""
+        row = self._conn().execute('SELECT cursor FROM cursors WHERE source = ?', (source,)).fetchone()
+        return row[0] if row else None
+
+    def save_cursor(self, source, cursor):
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', (source, cursor))
+
+    def pending_count(self):
+        """Number of payments that can still be matched"""
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM pending WHERE expires_at > ?', (time.time(),)
+        ).fetchone()[0]
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return conn
+
+
+class PaymentPoller:
+    """Polls a transaction source on a schedule and settles the matched payments.
+
+    Each poll fetches up to max_batches batches of batch_size transfers,
+    claims them in the book and calls settle([(payment, transaction)])
+    once per batch. The cursor is saved after every batch.
+    """
+
+    def __init__(self, book, source, settle, interval=30, batch_size=100, max_batches=10):
+        self.book = book
+        self.source = source
+        self.settle = settle
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start the polling thread, reading transfers made from now on"""
+        self.cursor()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name='payment-poller')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the polling thread"""
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    def poll(self):
+        """Fetch and settle the transfers since the last poll; returns the number matched"""
+        cursor = self.cursor()
+        settled = 0
+        for _ in range(self.max_batches):
+            transactions, cursor = self.source.fetch(cursor, self.batch_size)
+            if transactions:
+                matched, unmatched = self.book.claim(transactions)
+                metrics.PAYMENTS.inc('matched', amount=len(matched))
+                metrics.PAYMENTS.inc('unmatched', amount=len(unmatched))
+                for transaction in unmatched:
+                    logger.warning("Unmatched transfer %s of %s USDT", transaction.txid,
+                                   format_amount(transaction.amount))
+                if matched:
+                    try:
+                        self.settle(matched)
+                    except Exception as e:
+                        # Already claimed: the transactions table has the user and tier to grant by hand
+                        logger.error("Failed to settle %d payments: %s", len(matched), e)
+                    settled += len(matched)
+            self.book.save_cursor(self.source.name, cursor)
+            if len(transactions) < self.batch_size:
+                break
+        return settled
+
+    def cursor(self):
+        """Saved cursor of the source, started now if it was never polled"""
+        cursor = self.book.cursor(self.source.name)
+        if not cursor:
+            # Transfers made before that cannot be for our payments
+            cursor = self.source.start()
+            self.book.save_cursor(self.source.name, cursor)
+        return cursor
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                settled = self.poll()
+                if settled:
+                    logger.info("Settled %d payments", settled)
+            except Exception as e:
+                logger.error("Payment poll failed: %s", e)
+
+
+class FakeLedger:
+    """Local stand-in for a blockchain: transfers appended to a JSON-lines file.
+
+    The cursor is the byte offset after the last transfer read, so
+    transfers added while the bot runs are picked up on the next poll.
+    """
+
+    def __init__(self, path='ledger.jsonl'):
+        self.path = path
+        self.name = f"fake:{path}"
+
+    def transfer(self, amount, reference=None, txid=None):
+        """Record an incoming transfer of amount USDT"""
+        transaction = {
+            'txid': txid or secrets.token_hex(16),
+            'amount': str(amount),
+            'reference': reference,
+            'timestamp': time.time()
+        }
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(transaction) + '\n')
+        return transaction['txid']
+
+    def start(self):
+        try:
+            return str(os.path.getsize(self.path))
+        except FileNotFoundError:
+            return '0'
+
+    def fetch(self, cursor, limit):
+        offset = int(cursor)
+        transactions = []
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                while len(transactions) < limit:
+                    line = f.readline()
+                    if not line.endswith(b'\n'):
+                        # Nothing more, or a line still being written
+                        break
+                    offset += len(line)
+                    entry = json.loads(line)
+                    transactions.append(Transaction(
+                        entry['txid'], to_units(entry['amount']), entry.get('reference'), entry['timestamp']
+                    ))
+        except FileNotFoundError:
+            pass
+        return transactions, str(offset)
+
+
+class TronGridSource:
+    """USDT TRC20 transfers to an address, read from the TronGrid API.
+
+    address() returns the bare wallet address to watch, the one users are
+    told to pay to; each address keeps its own cursor. The cursor is the block
+    timestamp (ms) of the last transfer read; it is inclusive, and the
+    book skips transfers it has already seen.
+    """
+
+    USDT_CONTRACT = 'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t'
+
+    def __init__(self, address, api_key=None, url='https://api.trongrid.io', timeout=10):
+        self.address = address
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers['TRON-PRO-API-KEY'] = api_key
+
+    @property
+    def name(self):
+        return f"trongrid:{self.address()}"
+
+    def start(self):
+        return str(int(time.time() * 1000))
+
+    def fetch(self, cursor, limit):
+        response = self.session.get(
+            f"{self.url}/v1/accounts/{self.address()}/transactions/trc20",
+            params={
+                'only_to': 'true',
+                'only_confirmed': 'true',
+                'contract_address': self.USDT_CONTRACT,
+                'min_timestamp': cursor,
+                'order_by': 'block_timestamp,asc',
+                'limit': limit
+            },
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        transactions = []
+        for entry in response.json().get('data', []):
+            decimals = int(entry.get('token_info', {}).get('decimals', 6))
+            transactions.append(Transaction(
+                entry['transaction_id'],
+                int(entry['value']) * UNIT // 10 ** decimals,
+                None,
+                entry['block_timestamp'] / 1000
+            ))
+            cursor = str(entry['block_timestamp'])
+        return transactions, cursor
+
+
+def enabled():
+    """True if PAYMENT_SOURCE turns on automatic verification"""
+    return os.getenv('PAYMENT_SOURCE', 'manual') != 'manual'
+
+
+def source_from_env(address):
+    """The transaction source named by PAYMENT_SOURCE, or None for manual verification"""
+    source = os.getenv('PAYMENT_SOURCE', 'manual')
+    if source == 'manual':
+        return None
+    if source == 'fake':
+        return FakeLedger(os.getenv('FAKE_LEDGER_PATH', 'ledger.jsonl'))
+    if source == 'trongrid':
+        return TronGridSource(address, api_key=os.getenv('TRONGRID_API_KEY'))
+    raise ValueError(f"Unknown PAYMENT_SOURCE: {source}")
+
+
+def from_env(settle, address):
+    """PaymentBook and PaymentPoller configured from PAYMENT_* variables, or (None, None).
+
+    address() returns the bare wallet address users are told to pay to.
+    """
+    source = source_from_env(address)
+    if source is None:
+        return None, None
+    book = PaymentBook(
+        os.getenv('PAYMENTS_PATH', 'payments.db'),
+        window=int(os.getenv('PAYMENT_WINDOW', '7200'))
+    )
+    book.load()
+    poller = PaymentPoller(book, source, settle, interval=float(os.getenv('PAYMENT_POLL_INTERVAL', '30')))
+    return book, poller
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__.strip().splitlines()[-1].strip())
+        sys.exit(1)
+    ledger = FakeLedger(os.getenv('FAKE_LEDGER_PATH', 'ledger.jsonl'))
+    print(ledger.transfer(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
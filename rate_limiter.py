@@ -0,0 +1,140 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+import metrics
+
+# Set while handling an admin's update so their replies jump the queue
+_urgent = contextvars.ContextVar('urgent', default=False)
+
+
+class TokenBucket:
+    """Token bucket kept as a theoretical arrival time (GCRA).
+
+    reserve() books the next free slot and returns how long the caller has
+    to wait for it, so the same bucket serves threads (time.sleep) and
+    coroutines (asyncio.sleep). Up to burst calls go through at once,
+    then one every 1/rate seconds.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * (burst - 1)
+        self.tat = 0.0
+
+    def reserve(self, now, earliest=0.0, headroom=0.0):
+        """Book a slot no sooner than earliest and return its start time"""
+        start = max(now, earliest, self.tat - self.tolerance - headroom)
+        self.tat = max(self.tat, start) + self.interval
+        return start
+
+    def try_acquire(self, now):
+        """Take a token if one is free right now; never books a later slot"""
+        if self.tat - self.tolerance > now:
+            return False
+        self.tat = max(self.tat, now) + self.interval
+        return True
+
+    def refund(self):
+        """Give back the last token taken"""
+        self.tat -= self.interval
+
+    def idle(self, now):
+        """True once the bucket has fully refilled"""
+        return self.tat <= now
+
+
+class OutboundLimiter:
+    """Global and per-chat token buckets for outbound Bot API calls.
+
+    Telegram allows about 30 messages per second overall, one per second in
+    a private chat and 20 per minute in a group. Calls that target a chat
+    reserve a slot in that chat's bucket, then one in the global bucket.
+    Urgent calls (admin replies) get extra headroom in the global bucket and
+    so skip ahead of queued traffic. A 429 blocks every call for retry_after.
+    """
+
+    def __init__(self, global_rate=25, chat_rate=1, chat_burst=3,
+                 group_rate=20 / 60, group_burst=3, urgent_headroom=5):
+        self.global_bucket = TokenBucket(global_rate, burst=global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.urgent_headroom = urgent_headroom * self.global_bucket.interval
+        self.chats = {}
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, chat_id):
+        """Book a send slot for a chat and return the seconds to wait for it"""
+        now = time.monotonic()
+        key = str(chat_id)
+        with self.lock:
+            bucket = self.chats.get(key)
+            if bucket is None:
+                if len(self.chats) > 10000:
+                    self._prune(now)
+                if key.startswith('-') or key.startswith('@'):
+                    bucket = TokenBucket(self.group_rate, self.group_burst)
+                else:
+                    bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self.chats[key] = bucket
+            earliest = max(bucket.reserve(now), self.blocked_until)
+            headroom = self.urgent_headroom if _urgent.get() else 0.0
+            start = self.global_bucket.reserve(now, earliest, headroom)
+        delay = start - now
+        if delay > 0:
+            metrics.OUTBOUND_THROTTLED.inc()
+            metrics.OUTBOUND_DELAY.observe(delay)
+        return delay
+
+    def backoff(self, retry_after):
+        """Hold every call for retry_after seconds after a 429"""
+        metrics.OUTBOUND_RETRY_AFTER.inc()
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def _prune(self, now):
+        for key in [key for key, bucket in self.chats.items() if bucket.idle(now)]:
+            del self.chats[key]
+
+
+@contextlib.contextmanager
+def urgent():
+    """Mark the Bot API calls made inside the block as urgent"""
+    token = _urgent.set(True)
+    try:
+        yield
+    finally:
+        _urgent.reset(token)
+
+
+def retry_after(result_json, default=1):
+    """retry_after seconds from a Bot API error response"""
+    try:
+        return float(result_json['parameters']['retry_after'])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+def rewind_files(files):
+    """Seek the file objects of an upload back to the start before it is retried"""
+    for value in (files or {}).values():
+        if isinstance(value, tuple):
+            value = value[1]
+        if hasattr(value, 'seek'):
+            value.seek(0)
+
+
+def from_env():
+    """Build the outbound limiter from OUTBOUND_* environment variables"""
+    return OutboundLimiter(
+        global_rate=float(os.getenv('OUTBOUND_GLOBAL_RATE', '25')),
+        chat_rate=float(os.getenv('OUTBOUND_CHAT_RATE', '1')),
+        chat_burst=int(os.getenv('OUTBOUND_CHAT_BURST', '3')),
+        group_rate=float(os.getenv('OUTBOUND_GROUP_RATE', '20')) / 60,
+        urgent_headroom=int(os.getenv('OUTBOUND_URGENT_HEADROOM', '5'))
+    )
@@ -0,0 +1,280 @@
+"""Minimal in-memory Redis stand-in for trying USER_STORE=redis locally.
+
+Run with: python redis_standin.py [port]
+Then start each bot process with USER_STORE=redis REDIS_URL=redis://localhost:6390/0
+
+Speaks just enough of the Redis protocol for RedisStore: sorted sets,
+MULTI/EXEC with WATCH and PUBLISH/SUBSCRIBE. Several bot processes can
+share it to check that grants and cache invalidations reach every
+process, without installing Redis. Data lives in memory only, and range
+queries sort the whole set, which is fine for testing and nothing else.
+"""
+import asyncio
+import sys
+
+
+class Simple(str):
+    """Simple string reply (+OK)"""
+
+
+class Error(str):
+    """Error reply"""
+
+
+class Raw(bytes):
+    """Reply already in the Redis protocol"""
+
+
+# Reply for an EXEC aborted by WATCH
+NULL_ARRAY = object()
+
+
+def encode(value):
+    """A reply in the Redis protocol"""
+    if isinstance(value, Raw):
+        return bytes(value)
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, Simple):
+        return b'+' + value.encode() + b'\r\n'
+    if isinstance(value, Error):
+        return b'-ERR ' + value.encode() + b'\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, float):
+        value = format(value, '.17g')
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if value is NULL_ARRAY:
+        return b'*-1\r\n'
+    return b'*%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+
+
+def bound(text):
+    """(value, exclusive) for a score range bound like 5, (5, -inf or +inf"""
+    if text in ('-inf', '+inf', 'inf'):
+        return (float(text), False)
+    if text.startswith('('):
+        return (float(text[1:]), True)
+    return (float(text), False)
+
+
+def in_range(score, low, high):
+    if score < low[0] or (low[1] and score == low[0]):
+        return False
+    if score > high[0] or (high[1] and score == high[0]):
+        return False
+    return True
+
+
+class Client:
+    """State of one connection"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.watched = {}
+        self.queued = None
+        self.channels = set()
+
+
+class StandIn:
+    def __init__(self):
+        self.zsets = {}
+        self.versions = {}
+        self.subscribers = {}
+
+    async def serve(self, reader, writer):
+        client = Client(writer)
+        try:
+            while True:
+                command = await self.read_command(reader)
+                if command is None:
+                    break
+                writer.write(self.dispatch(client, command))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in client.channels:
+                self.subscribers[channel].discard(client)
+            writer.close()
+
+    async def read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.decode().split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2].decode())
+        return args
+
+    def dispatch(self, client, command):
+        name = command[0].upper()
+        args = command[1:]
+        if name == 'MULTI':
+            client.queued = []
+            return encode(Simple('OK'))
+        if name == 'DISCARD':
+            client.queued = None
+            client.watched = {}
+            return encode(Simple('OK'))
+        if name == 'EXEC':
+            queued, client.queued = client.queued or [], None
+            watched, client.watched = client.watched, {}
+            if any(self.versions.get(key, 0) != version for key, version in watched.items()):
+                return encode(NULL_ARRAY)
+            return b'*%d\r\n' % len(queued) + b''.join(encode(self.run(client, *command)) for command in queued)
+        if client.queued is not None:
+            client.queued.append((name, args))
+            return encode(Simple('QUEUED'))
+        return encode(self.run(client, name, args))
+
+    def run(self, client, name, args):
+        handler = getattr(self, 'cmd_' + name.lower(), None)
+        if handler is None:
+            return Error(f"unknown command '{name}'")
+        try:
+            return handler(client, *args)
+        except (TypeError, ValueError) as e:
+            return Error(str(e))
+
+    def zset(self, key):
+        return self.zsets.get(key, {})
+
+    def touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def cmd_ping(self, client, *args):
+        if client.channels:
+            return ['pong', '']
+        return Simple('PONG')
+
+    def cmd_client(self, client, *args):
+        return Simple('OK')
+
+    def cmd_select(self, client, index):
+        return Simple('OK')
+
+    def cmd_flushall(self, client, *args):
+        for key in self.zsets:
+            self.touch(key)
+        self.zsets = {}
+        return Simple('OK')
+
+    def cmd_watch(self, client, *keys):
+        for key in keys:
+            client.watched[key] = self.versions.get(key, 0)
+        return Simple('OK')
+
+    def cmd_unwatch(self, client):
+        client.watched = {}
+        return Simple('OK')
+
+    def cmd_zadd(self, client, key, *pairs):
+        zset = self.zsets.setdefault(key, {})
+        added = 0
+        for index in range(0, len(pairs), 2):
+            score, member = float(pairs[index]), pairs[index + 1]
+            if member not in zset:
+                added += 1
+            zset[member] = score
+        self.touch(key)
+        return added
+
+    def cmd_zrem(self, client, key, *members):
+        zset = self.zset(key)
+        removed = sum(1 for member in members if zset.pop(member, None) is not None)
+        if removed:
+            self.touch(key)
+        return removed
+
+    def cmd_del(self, client, *keys):
+        removed = 0
+        for key in keys:
+            if self.zsets.pop(key, None) is not None:
+                self.touch(key)
+                removed += 1
+        return removed
+
+    def cmd_zscore(self, client, key, member):
+        return self.zset(key).get(member)
+
+    def cmd_zmscore(self, client, key, *members):
+        zset = self.zset(key)
+        return [zset.get(member) for member in members]
+
+    def cmd_zcard(self, client, key):
+        return len(self.zset(key))
+
+    def cmd_zrange(self, client, key, start, stop, *options):
+        items = sorted(self.zset(key).items(), key=lambda item: (item[1], item[0]))
+        start, stop = int(start), int(stop)
+        stop = len(items) if stop == -1 else stop + 1
+        return self.reply_items(items[start:stop], options)
+
+    def cmd_zrangebyscore(self, client, key, low, high, *options):
+        return self.range_by_score(key, bound(low), bound(high), options, reverse=False)
+
+    def cmd_zrevrangebyscore(self, client, key, high, low, *options):
+        return self.range_by_score(key, bound(low), bound(high), options, reverse=True)
+
+    def range_by_score(self, key, low, high, options, reverse):
+        items = sorted(
+            (item for item in self.zset(key).items() if in_range(item[1], low, high)),
+            key=lambda item: (item[1], item[0]), reverse=reverse
+        )
+        upper = [option.upper() for option in options]
+        if 'LIMIT' in upper:
+            index = upper.index('LIMIT')
+            offset, count = int(options[index + 1]), int(options[index + 2])
+            items = items[offset:] if count < 0 else items[offset:offset + count]
+        return self.reply_items(items, options)
+
+    def reply_items(self, items, options):
+        if 'WITHSCORES' in [option.upper() for option in options]:
+            return [value for member, score in items for value in (member, score)]
+        return [member for member, score in items]
+
+    def cmd_publish(self, client, channel, message):
+        receivers = self.subscribers.get(channel, set())
+        payload = encode(['message', channel, message])
+        for receiver in receivers:
+            receiver.writer.write(payload)
+        return len(receivers)
+
+    def cmd_subscribe(self, client, *channels):
+        replies = []
+        for channel in channels:
+            client.channels.add(channel)
+            self.subscribers.setdefault(channel, set()).add(client)
+            replies.append(encode(['subscribe', channel, len(client.channels)]))
+        # One reply per channel, not wrapped in an array
+        return Raw(b''.join(replies))
+
+    def cmd_unsubscribe(self, client, *channels):
+        replies = []
+        for channel in channels or list(client.channels):
+            client.channels.discard(channel)
+            self.subscribers.get(channel, set()).discard(client)
+            replies.append(encode(['unsubscribe', channel, len(client.channels)]))
+        return Raw(b''.join(replies) or encode(['unsubscribe', None, 0]))
+
+
+async def main(port):
+    standin = StandIn()
+    server = await asyncio.start_server(standin.serve, '127.0.0.1', port)
+    print(f"Redis stand-in listening on 127.0.0.1:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 6390))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,37 @@
+class CallbackRouter:
+    """Route table mapping callback_data to handlers with a single dict lookup.
+
+    callback_data is split on the first ':' into a route name and an
+    optional parameter, so 'pkg:basic' calls the 'pkg' handler with
+    'basic'. Handlers take the callback query, plus the parameter for
+    parameterized routes, and dispatch returns what they return. The
+    runtimes time each callback per route (see route_name in handlers).
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def add(self, name, handler):
+        """Register a handler for a route name"""
+        self.routes[name] = handler
+
+    def route(self, name):
+        """Decorator registering a handler for a route name"""
+        def decorator(handler):
+            self.add(name, handler)
+            return handler
+        return decorator
+
+    def matches(self, data):
+        """True if the callback_data has a registered route"""
+        return bool(data) and data.partition(':')[0] in self.routes
+
+    def dispatch(self, call):
+        """Run the handler for a callback query and return its result (None if no route matched)"""
+        name, separator, param = (call.data or '').partition(':')
+        handler = self.routes.get(name)
+        if handler is None:
+            return None
+        if separator:
+            return handler(call, param)
+        return handler(call)
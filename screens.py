@@ -0,0 +1,103 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ScreenRegistry:
+    """Cache of static menu screens rendered once and reused on every click.
+
+    A screen builder returns (text, markup). The registry renders it once
+    and keeps the text together with the reply_markup already serialized
+    to JSON, which TeleBot sends as is. Only the chat and message ids then
+    change between callbacks.
+
+    version is a cheap callable returning a value that changes whenever
+    the screens must be rendered again (e.g. after a catalog or template
+    reload); get() checks it and drops the cache when it moved.
+    """
+
+    def __init__(self, version=None):
+        self.builders = {}
+        self.cache = {}
+        self.version = version
+        self.built_version = None
+        self.lock = threading.Lock()
+
+    def screen(self, name):
+        """Decorator registering a screen builder under a name"""
+        def decorator(builder):
+            self.register(name, builder)
+            return builder
+        return decorator
+
+    def register(self, name, builder):
+        """Register a screen builder under a name"""
+        self.builders[name] = builder
+        self.cache.pop(name, None)
+
+    def get(self, name):
+        """Return (text, reply_markup JSON) for a screen, rendering it on first use"""
+        if self.version is not None and self.version() != self.built_version:
+            self.invalidate()
+        screen = self.cache.get(name)
+        if screen is None:
+            with self.lock:
+                screen = self.cache.get(name)
+                if screen is None:
+                    screen = self._render(name)
+                    self.cache[name] = screen
+        return screen
+
+    def build(self):
+        """Render every registered screen up front"""
+        with self.lock:
+            self.built_version = self._version()
+            self.cache = {name: self._render(name) for name in self.builders}
+        logger.info("Rendered %d screens", len(self.cache))
+
+    def invalidate(self):
+        """Drop every cached screen"""
+        with self.lock:
+            self.built_version = self._version()
+            self.cache = {}
+
+    def _version(self):
+        return None if self.version is None else self.version()
+
+    def _render(self, name):
+        text, markup = self.builders[name]()
+        return text, markup.to_json()
+
+
+class RenderedMessages:
+    """Remembers what each bot message currently shows, to skip no-op edits.
+
+    Keyed by (chat_id, message_id) and holding a hash of the text and the
+    serialized keyboard. The oldest messages are forgotten past max_size.
+    Only correct in a process that makes every edit of those messages.
+    """
+
+    def __init__(self, max_size=50000):
+        self.hashes = OrderedDict()
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def update(self, key, text, markup_json):
+        """Record what a message will show; returns False if it already shows it"""
+        digest = hash((text, markup_json))
+        with self.lock:
+            if self.hashes.get(key) == digest:
+                self.hashes.move_to_end(key)
+                return False
+            self.hashes[key] = digest
+            self.hashes.move_to_end(key)
+            if len(self.hashes) > self.max_size:
+                self.hashes.popitem(last=False)
+        return True
+
+    def forget(self, key):
+        """Drop what is known about a message, e.g. after a failed edit"""
+        with self.lock:
+            self.hashes.pop(key, None)
@@ -0,0 +1,40 @@
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Breakdown of the time spent in each boot phase.
+
+    started is a time.perf_counter() value taken as early as possible,
+    before the heavy imports. Each mark() closes the phase that began at
+    the previous mark, and report() logs the phases once the bot is ready.
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.last = self.started
+        self.phases = []
+        metrics.Gauge('bot_startup_seconds', 'Time from process start until the bot was ready',
+                      lambda: round(self.total(), 6))
+
+    def mark(self, phase):
+        """End a phase and start timing the next one"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def total(self):
+        """Seconds from start to the last mark"""
+        return self.last - self.started
+
+    def summary(self):
+        parts = ', '.join(f"{phase} {elapsed * 1000:.0f}ms" for phase, elapsed in self.phases)
+        return f"Startup took {self.total() * 1000:.0f}ms ({parts})"
+
+    def report(self):
+        """Log the startup breakdown"""
+        logger.info(self.summary())
@@ -0,0 +1,163 @@
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# {name}, {name|filter}, and {{ / }} for literal braces
+PLACEHOLDER = re.compile(r'\{\{|\}\}|\{(\w+)(?:\|(\w+))?\}')
+
+FILTERS = {
+    'bullets': lambda items: '\n'.join(f"- {item}" for item in items),
+    'lines': lambda items: '\n'.join(str(item) for item in items)
+}
+
+
+class Template:
+    """Text with {field} placeholders, parsed once into segments.
+
+    segments alternates static strings and (field, filter) pairs, with
+    adjacent static text merged, so render() is one pass and one join.
+    partial() fills some fields ahead of time and returns a template with
+    fewer dynamic segments, e.g. everything but the user's name and ID.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+
+    @classmethod
+    def compile(cls, source):
+        segments = []
+        position = 0
+        for match in PLACEHOLDER.finditer(source):
+            segments.append(source[position:match.start()])
+            if match.group(1) is None:
+                segments.append(match.group(0)[0])
+            else:
+                name, filter_name = match.groups()
+                if filter_name is not None and filter_name not in FILTERS:
+                    raise ValueError(f"Unknown template filter: {filter_name}")
+                segments.append((name, filter_name))
+            position = match.end()
+        segments.append(source[position:])
+        return cls(merge(segments))
+
+    def fields(self):
+        """Names of the fields still to be filled in"""
+        return {segment[0] for segment in self.segments if not isinstance(segment, str)}
+
+    def render(self, **values):
+        return ''.join(
+            segment if isinstance(segment, str) else fill(segment, values)
+            for segment in self.segments
+        )
+
+    def partial(self, **values):
+        """Template with the given fields filled in and the others left open"""
+        return Template(merge([
+            fill(segment, values) if not isinstance(segment, str) and segment[0] in values else segment
+            for segment in self.segments
+        ]))
+
+
+def fill(segment, values):
+    name, filter_name = segment
+    value = values[name]
+    if filter_name is not None:
+        return FILTERS[filter_name](value)
+    return str(value)
+
+
+def merge(segments):
+    """Join adjacent static segments and drop empty ones"""
+    merged = []
+    for segment in segments:
+        if isinstance(segment, str):
+            if not segment:
+                continue
+            if merged and isinstance(merged[-1], str):
+                merged[-1] += segment
+                continue
+        merged.append(segment)
+    return merged
+
+
+class TemplateLibrary:
+    """Templates compiled from the .txt files of a directory.
+
+    check() looks at the file modification times at most every
+    check_interval seconds and recompiles everything when one changed,
+    bumping version; a file that fails to compile keeps the old set in
+    place. variant() caches partially filled templates per key (e.g. per
+    tier) until the next reload.
+    """
+
+    def __init__(self, directory, check_interval=2.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.templates = {}
+        self.variants = {}
+        self.mtimes = None
+        self.version = 0
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.load()
+
+    def _mtimes(self):
+        return {
+            entry.name: entry.stat().st_mtime
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith('.txt')
+        }
+
+    def load(self, if_changed=False):
+        """Compile every template file"""
+        with self.lock:
+            mtimes = self._mtimes()
+            if if_changed and mtimes == self.mtimes:
+                # Another thread reloaded them meanwhile
+                return True
+            self.mtimes = mtimes
+            try:
+                templates = {}
+                for filename in mtimes:
+                    with open(os.path.join(self.directory, filename), encoding='utf-8') as f:
+                        templates[filename[:-4]] = Template.compile(f.read())
+            except (OSError, ValueError) as e:
+                logger.error("Keeping the previous templates, reload failed: %s", e)
+                return False
+            self.templates = templates
+            self.variants = {}
+            self.version += 1
+        logger.info("Loaded %d templates (version %d)", len(templates), self.version)
+        return True
+
+    def check(self):
+        """Reload the templates if a file changed; returns the current version"""
+        now = time.monotonic()
+        if now - self.checked >= self.check_interval:
+            self.checked = now
+            try:
+                changed = self._mtimes() != self.mtimes
+            except OSError as e:
+                logger.error("Cannot read the template directory: %s", e)
+                changed = False
+            if changed:
+                self.load(if_changed=True)
+        return self.version
+
+    def get(self, name):
+        """The compiled template for a file name without .txt"""
+        self.check()
+        return self.templates[name]
+
+    def variant(self, name, key, **values):
+        """Template with values filled in, cached under key until the next reload"""
+        self.check()
+        variants = self.variants
+        template = variants.get((name, key))
+        if template is None:
+            template = variants[(name, key)] = self.templates[name].partial(**values)
+        return template
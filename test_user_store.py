@@ -0,0 +1,119 @@
+"""Tests for per-tier expiry in the premium user stores."""
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from user_store import JsonStore, SqliteStore
+
+
+class ExpiryCases:
+    """Cases shared by every backend; subclasses provide open_store()"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = self.open_store()
+        self.store.load()
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_timed_upgrade_falls_back_to_permanent_basic(self):
+        now = time.time()
+        self.store.add(1, 'basic')
+        self.store.add(1, 'advanced', now + 60)
+        self.assertEqual(self.store.get_tier(1), 'advanced')
+        self.assertEqual(self.store.expires_at(1), now + 60)
+
+        self.assertEqual(self.store.expire([1], now + 61), [(1, 'advanced')])
+        self.assertEqual(self.store.get_tier(1), 'basic')
+        self.assertIsNone(self.store.expires_at(1))
+
+    def test_basic_purchase_during_advanced_trial(self):
+        now = time.time()
+        self.store.add(2, 'advanced', now + 60)
+        self.store.add(2, 'basic')
+        self.assertEqual(self.store.get_tier(2), 'advanced')
+
+        self.assertEqual(self.store.expire([2], now + 61), [(2, 'advanced')])
+        self.assertEqual(self.store.get_tier(2), 'basic')
+
+    def test_expiry_of_only_grant_revokes_user(self):
+        now = time.time()
+        self.store.add(3, 'basic', now + 60)
+        self.assertEqual(self.store.expire([3], now + 30), [])
+        self.assertEqual(self.store.expire([3], now + 61), [(3, 'basic')])
+        self.assertIsNone(self.store.get_tier(3))
+
+    def test_permanent_grant_clears_expiry(self):
+        now = time.time()
+        self.store.add(4, 'advanced', now + 60)
+        self.store.add(4, 'advanced')
+        self.assertEqual(self.store.expire([4], now + 61), [])
+        self.assertEqual(self.store.get_tier(4), 'advanced')
+
+    def test_user_listed_under_highest_tier(self):
+        self.store.add_many([1, 2, 3], 'basic')
+        self.store.add_many([2, 4], 'advanced')
+        self.assertEqual(self.store.count('basic'), 2)
+        self.assertEqual(self.store.count('advanced'), 2)
+        self.assertEqual(self.store.page('basic', limit=1), [1])
+        self.assertEqual(self.store.page('basic', after=1), [3])
+        self.assertEqual(self.store.page('basic', before=3), [1])
+        self.assertEqual(list(self.store.iter_users('advanced')), [2, 4])
+
+
+class JsonStoreTest(ExpiryCases, unittest.TestCase):
+
+    def open_store(self):
+        return JsonStore(os.path.join(self.directory.name, 'premium_users.json'))
+
+    def test_replay_after_restart(self):
+        now = time.time()
+        self.store.add(5, 'basic')
+        self.store.add(5, 'advanced', now + 60)
+        self.store.expire([5], now + 61)
+        self.store.close()
+
+        self.store = self.open_store()
+        self.store.load()
+        self.assertEqual(self.store.get_tier(5), 'basic')
+        self.assertEqual(self.store.expiring(), [])
+
+    def test_loads_single_expiry_snapshot(self):
+        self.store.close()
+        with open(self.store.path, 'w') as f:
+            json.dump({'premium_users': [6], 'full_premium_users': [6], 'expires': {'6': 100.0}}, f)
+
+        self.store = self.open_store()
+        self.store.load()
+        self.assertEqual(sorted(self.store.expiring()), [(6, 100.0), (6, 100.0)])
+        self.assertIsNone(self.store.get_tier(6))
+
+
+class SqliteStoreTest(ExpiryCases, unittest.TestCase):
+
+    def open_store(self):
+        return SqliteStore(os.path.join(self.directory.name, 'premium_users.db'))
+
+    def test_migrates_users_table(self):
+        self.store.close()
+        path = os.path.join(self.directory.name, 'old.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE users (user_id INTEGER PRIMARY KEY, tier TEXT NOT NULL, expires_at REAL)')
+        conn.execute("INSERT INTO users VALUES (7, 'advanced', NULL), (8, 'basic', 100.0)")
+        conn.commit()
+        conn.close()
+
+        self.store = SqliteStore(path)
+        self.store.load()
+        self.assertEqual(self.store.get_tier(7), 'advanced')
+        self.assertIsNone(self.store.get_tier(8))
+        self.assertEqual(self.store.expiring(), [(8, 100.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update):
+    """Return the chat id an update belongs to, used to keep per-chat order"""
+    for message in (update.message, update.edited_message,
+                    update.channel_post, update.edited_channel_post):
+        if message:
+            return message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    if update.my_chat_member:
+        return update.my_chat_member.chat.id
+    if update.chat_member:
+        return update.chat_member.chat.id
+    if update.inline_query:
+        return update.inline_query.from_user.id
+    return update.update_id
+
+
+def update_type(update):
+    """Name of the update field that is set, e.g. 'message' or 'callback_query'"""
+    for name in ('message', 'edited_message', 'callback_query', 'channel_post',
+                 'edited_channel_post', 'inline_query', 'my_chat_member', 'chat_member'):
+        if getattr(update, name, None):
+            return name
+    return 'other'
+
+
+class UpdateQueue:
+    """Bounded webhook ingestion queue drained by a pool of worker threads.
+
+    Each worker owns one shard and every update of a chat is routed to the
+    same shard, so updates of one chat are handled strictly in arrival
+    order while different chats are handled in parallel.
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000):
+        self.handler = handler
+        self.workers = max(1, workers)
+        shard_size = max(1, maxsize // self.workers)
+        self.maxsize = shard_size * self.workers
+        self.shards = [queue.Queue(maxsize=shard_size) for _ in range(self.workers)]
+        self.threads = []
+        self.lock = threading.Lock()
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.high_water = 0
+        self.busy_time = 0.0
+
+    def start(self):
+        """Start the worker threads"""
+        for index, shard in enumerate(self.shards):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(shard,),
+                name=f"update-worker-{index}"
+            )
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        logger.info("Update queue started with %d workers (capacity %d)", self.workers, self.maxsize)
+
+    def stop(self, timeout=10):
+        """Let the workers drain their shards and exit"""
+        for shard in self.shards:
+            shard.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def put(self, update):
+        """Enqueue an update without blocking; returns False when the shard is full"""
+        shard = self.shards[hash(chat_key(update)) % self.workers]
+        try:
+            shard.put_nowait(update)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            logger.warning("Update queue full, rejecting update %s", update.update_id)
+            return False
+        with self.lock:
+            self.enqueued += 1
+            depth = self.depth()
+            if depth > self.high_water:
+                self.high_water = depth
+        return True
+
+    def depth(self):
+        """Number of updates waiting in all shards"""
+        return sum(shard.qsize() for shard in self.shards)
+
+    def stats(self):
+        """Snapshot of the queue counters"""
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'capacity': self.maxsize,
+                'depth': self.depth(),
+                'shard_depths': [shard.qsize() for shard in self.shards],
+                'high_water': self.high_water,
+                'enqueued': self.enqueued,
+                'processed': self.processed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'busy_seconds': round(self.busy_time, 3)
+            }
+
+    def _worker(self, shard):
+        while True:
+            update = shard.get()
+            if update is None:
+                break
+            started = time.perf_counter()
+            try:
+                self.handler(update)
+                failed = False
+            except Exception as e:
+                logger.error("Update %s failed: %s", update.update_id, e)
+                failed = True
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.processed += 1
+                self.busy_time += elapsed
+                if failed:
+                    self.failed += 1
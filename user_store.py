@@ -0,0 +1,822 @@
+"""Premium user stores.
+
+Every backend offers the same methods (load, get_tier, expires_at,
+expiring, count, iter_users, page, add, remove, add_many, remove_many,
+expire, close), and open_store() picks one by name: 'json' for a single
+process, 'sqlite' for several processes on one machine and 'redis' for
+several processes or nodes. count, page and iter_users list a user
+under their highest tier only, so a user holding both is never counted
+or messaged twice.
+"""
+import bisect
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class JsonStore:
+    """Premium user store persisted as a snapshot plus an append-only log.
+
+    Every grant or revoke appends one line to the log, so its cost does not
+    depend on the number of customers. Once the log reaches compact_every
+    entries the sets are written to a temporary snapshot that atomically
+    replaces the old one, and the log is truncated. Log operations are
+    idempotent, so replaying a log over a newer snapshot is harmless.
+
+    Each tier a user was granted is kept separately, with its own expiry
+    time (seconds since the epoch) if it has one; the user's tier is the
+    highest one that has not expired. Expiry revokes only the grant that
+    ran out, so a timed advanced grant falls back to a basic one.
+    """
+
+    def __init__(self, path='premium_users.json', compact_every=1000):
+        self.path = path
+        self.log_path = os.path.splitext(path)[0] + '.log'
+        self.compact_every = compact_every
+        self.premium_users = set()
+        self.full_premium_users = set()
+        self.lock = threading.Lock()
+        self.log_file = None
+        self.log_entries = 0
+        # Sorted ids per tier for paging, rebuilt after a write
+        self.sorted_users = {}
+        # Expiry times per tier: {tier: {user_id: expires_at}}
+        self.expires = {'basic': {}, 'advanced': {}}
+
+    def load(self):
+        """Read the snapshot, replay the log on top and open the log for appending"""
+        with self.lock:
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                    self.premium_users.update(data.get('premium_users', []))
+                    self.full_premium_users.update(data.get('full_premium_users', []))
+                    expires = data.get('expires', {})
+                    if expires and not set(expires) <= set(self.expires):
+                        # Snapshots from before per-tier expiry: one time for all the user's tiers
+                        expires = {
+                            tier: {user_id: expires_at for user_id, expires_at in expires.items()
+                                   if int(user_id) in self._users(tier)}
+                            for tier in self.expires
+                        }
+                    for tier, times in expires.items():
+                        self.expires[tier].update((int(user_id), expires_at) for user_id, expires_at in times.items())
+            except FileNotFoundError:
+                pass  # First time running
+
+            self.log_entries = 0
+            try:
+                with open(self.log_path, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # Torn last line from a crash mid-append
+                            logger.warning("Skipping corrupt log entry in %s", self.log_path)
+                            continue
+                        self._apply(entry)
+                        self.log_entries += len(entry.get('user_ids', ())) or 1
+            except FileNotFoundError:
+                pass
+
+            self.log_file = open(self.log_path, 'a')
+
+    def get_tier(self, user_id):
+        """Return the highest tier of a user that has not expired, or None"""
+        return self._grant(user_id, time.time())[0]
+
+    def expires_at(self, user_id):
+        """When the user's current tier expires (seconds since the epoch), or None if it does not"""
+        return self._grant(user_id, time.time())[1]
+
+    def expiring(self):
+        """(user_id, expires_at) of every time-bounded grant"""
+        with self.lock:
+            return [item for times in self.expires.values() for item in times.items()]
+
+    def _grant(self, user_id, now):
+        """(tier, expires_at) of the highest grant of a user still valid at now"""
+        return current({
+            tier: (user_id in self._users(tier), self.expires[tier].get(user_id)) for tier in self.expires
+        }, now)
+
+    def count(self, tier):
+        """Number of users whose highest tier is this one"""
+        with self.lock:
+            return len(self._members(tier))
+
+    def iter_users(self, tier):
+        """Iterate over the ids of users whose highest tier is this one"""
+        with self.lock:
+            users = self._members(tier)
+        return iter(users)
+
+    def page(self, tier, after=None, before=None, limit=50):
+        """Up to limit ids of a tier in ascending order, after or before a cursor id"""
+        with self.lock:
+            users = self._members(tier)
+            if before is not None:
+                end = bisect.bisect_left(users, before)
+                return users[max(end - limit, 0):end]
+            start = 0 if after is None else bisect.bisect_right(users, after)
+            return users[start:start + limit]
+
+    def add(self, user_id, tier, expires_at=None):
+        """Grant a tier ('basic' or 'advanced') to a user, until expires_at if given"""
+        entry = {'op': 'add', 'user_id': user_id, 'tier': tier}
+        if expires_at is not None:
+            entry['expires_at'] = expires_at
+        self._write(entry)
+
+    def remove(self, user_id):
+        """Revoke every tier of a user"""
+        self._write({'op': 'remove', 'user_id': user_id})
+
+    def add_many(self, user_ids, tier, expires_at=None):
+        """Grant a tier to many users at once; returns {user_id: previous tier}"""
+        entry = {'op': 'add_many', 'user_ids': list(user_ids), 'tier': tier}
+        if expires_at is not None:
+            entry['expires_at'] = expires_at
+        return self._write(entry)
+
+    def remove_many(self, user_ids):
+        """Revoke every tier of many users at once; returns {user_id: previous tier}"""
+        return self._write({'op': 'remove_many', 'user_ids': list(user_ids)})
+
+    def expire(self, user_ids, now):
+        """Revoke the grants of these users that expired by now, in one write; returns [(user_id, tier)]"""
+        with self.lock:
+            revoked = [
+                (user_id, tier) for user_id in user_ids for tier in ('advanced', 'basic')
+                if self.expires[tier].get(user_id, now + 1) <= now
+            ]
+            if revoked:
+                entry = {'op': 'revoke', 'grants': revoked}
+                self._apply(entry)
+                self._append(entry)
+        return revoked
+
+    def compact(self):
+        """Write a fresh snapshot and truncate the log"""
+        with self.lock:
+            self._compact()
+
+    def close(self):
+        """Close the log file"""
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+
+    def _users(self, tier):
+        return self.full_premium_users if tier == 'advanced' else self.premium_users
+
+    def _members(self, tier):
+        """Sorted ids of users whose highest tier is this one, cached until the next write"""
+        users = self.sorted_users.get(tier)
+        if users is None:
+            members = self._users(tier) if tier == 'advanced' else self.premium_users - self.full_premium_users
+            users = self.sorted_users[tier] = sorted(members)
+        return users
+
+    def _write(self, entry):
+        user_ids = entry['user_ids'] if 'user_ids' in entry else [entry['user_id']]
+        with self.lock:
+            previous = {user_id: self.get_tier(user_id) for user_id in user_ids}
+            self._apply(entry)
+            self._append(entry)
+        return previous
+
+    def _append(self, entry):
+        # A batch is a single log line, so a crash mid-append loses all of it or none
+        if self.log_file is None:
+            self.log_file = open(self.log_path, 'a')
+        self.log_file.write(json.dumps(entry) + '\n')
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        self.log_entries += len(entry.get('user_ids', entry.get('grants', ()))) or 1
+        if self.log_entries >= self.compact_every:
+            self._compact()
+
+    def _apply(self, entry):
+        self.sorted_users = {}
+        op = entry['op']
+        if op == 'revoke':
+            for user_id, tier in entry['grants']:
+                self._users(tier).discard(user_id)
+                self.expires[tier].pop(user_id, None)
+            return
+        user_ids = entry['user_ids'] if op.endswith('_many') else [entry['user_id']]
+        if op in ('add', 'add_many'):
+            tier = entry['tier']
+            self._users(tier).update(user_ids)
+            expires_at = entry.get('expires_at')
+            for user_id in user_ids:
+                if expires_at is None:
+                    self.expires[tier].pop(user_id, None)
+                else:
+                    self.expires[tier][user_id] = expires_at
+        elif op in ('remove', 'remove_many'):
+            self.premium_users.difference_update(user_ids)
+            self.full_premium_users.difference_update(user_ids)
+            for times in self.expires.values():
+                for user_id in user_ids:
+                    times.pop(user_id, None)
+
+    def _compact(self):
+        data = {
+            'premium_users': list(self.premium_users),
+            'full_premium_users': list(self.full_premium_users),
+            'expires': self.expires
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        # The snapshot now holds everything in the log
+        if self.log_file is not None:
+            self.log_file.close()
+        self.log_file = open(self.log_path, 'w')
+        self.log_entries = 0
+        logger.info("Compacted user store into %s", self.path)
+
+
+# Grant upsert: the latest grant of a tier sets its expiry
+GRANT_SQL = (
+    'INSERT INTO grants (user_id, tier, expires_at) VALUES (?, ?, ?) '
+    'ON CONFLICT (user_id, tier) DO UPDATE SET expires_at = excluded.expires_at'
+)
+
+# Grants that are their user's highest tier; a user is listed under one tier only
+MEMBER_SQL = (
+    "(grants.tier = 'advanced' OR NOT EXISTS ("
+    "SELECT 1 FROM grants higher WHERE higher.user_id = grants.user_id AND higher.tier = 'advanced'))"
+)
+
+# Highest grant of a user that has not expired, the advanced one first
+CURRENT_SQL = (
+    'SELECT tier, expires_at FROM grants WHERE user_id = ? AND (expires_at IS NULL OR expires_at > ?) '
+    "ORDER BY tier = 'advanced' DESC LIMIT 1"
+)
+
+
+class SqliteStore:
+    """Premium user store backed by an embedded SQLite database.
+
+    Grants live in a table keyed by (user_id, tier), so lookups hit the
+    primary key index instead of in-memory sets and memory stays flat as
+    the customer base grows. Each grant has its own expiry time, if any,
+    indexed for the expiry scheduler; the user's tier is the highest grant
+    that has not expired. The database runs in WAL mode, which lets
+    several worker processes read while one of them writes. Writes from
+    all threads are handed to a single writer thread that commits
+    whatever has queued up in one transaction (group commit).
+    """
+
+    def __init__(self, path='premium_users.db', max_batch=256):
+        self.path = path
+        self.max_batch = max_batch
+        self.local = threading.local()
+        self.pending = queue.Queue()
+        self.writer = None
+
+    def load(self):
+        """Create the schema and start the writer thread"""
+        conn = self._conn()
+        with conn:
+            # Taken before reading the schema, so one process migrates it
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS grants ('
+                'user_id INTEGER NOT NULL, '
+                'tier TEXT NOT NULL, '
+                'expires_at REAL, '
+                'PRIMARY KEY (user_id, tier)) WITHOUT ROWID'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS grants_tier ON grants (tier, user_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS grants_expiry ON grants (expires_at) WHERE expires_at IS NOT NULL')
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+                # Databases from before per-tier grants kept one row per user
+                columns = [row[1] for row in conn.execute('PRAGMA table_info(users)')]
+                expires = 'expires_at' if 'expires_at' in columns else 'NULL'
+                moved = conn.execute(
+                    f'INSERT OR IGNORE INTO grants SELECT user_id, tier, {expires} FROM users'
+                ).rowcount
+                conn.execute('DROP TABLE users')
+                logger.info("Moved %d users to per-tier grants", moved)
+        self.writer = threading.Thread(target=self._writer, name='sqlite-writer')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def get_tier(self, user_id):
+        """Return the highest tier of a user that has not expired, or None"""
+        row = self._conn().execute(CURRENT_SQL, (user_id, time.time())).fetchone()
+        return row[0] if row else None
+
+    def expires_at(self, user_id):
+        """When the user's current tier expires (seconds since the epoch), or None if it does not"""
+        row = self._conn().execute(CURRENT_SQL, (user_id, time.time())).fetchone()
+        return row[1] if row else None
+
+    def expiring(self):
+        """(user_id, expires_at) of every time-bounded grant"""
+        return self._conn().execute(
+            'SELECT user_id, expires_at FROM grants WHERE expires_at IS NOT NULL'
+        ).fetchall()
+
+    def count(self, tier):
+        """Number of users whose highest tier is this one"""
+        return self._conn().execute(
+            f'SELECT COUNT(*) FROM grants WHERE tier = ? AND {MEMBER_SQL}', (tier,)
+        ).fetchone()[0]
+
+    def iter_users(self, tier):
+        """Iterate over the ids of users whose highest tier is this one"""
+        cursor = self._conn().execute(
+            f'SELECT user_id FROM grants WHERE tier = ? AND {MEMBER_SQL} ORDER BY user_id', (tier,)
+        )
+        for row in cursor:
+            yield row[0]
+
+    def page(self, tier, after=None, before=None, limit=50):
+        """Up to limit ids of a tier in ascending order, after or before a cursor id"""
+        # Keyset pagination on the (tier, user_id) index, no OFFSET scan
+        if before is not None:
+            rows = self._conn().execute(
+                f'SELECT user_id FROM grants WHERE tier = ? AND {MEMBER_SQL} AND user_id < ? '
+                'ORDER BY user_id DESC LIMIT ?', (tier, before, limit)
+            ).fetchall()
+            return [row[0] for row in reversed(rows)]
+        if after is not None:
+            rows = self._conn().execute(
+                f'SELECT user_id FROM grants WHERE tier = ? AND {MEMBER_SQL} AND user_id > ? '
+                'ORDER BY user_id LIMIT ?', (tier, after, limit)
+            ).fetchall()
+        else:
+            rows = self._conn().execute(
+                f'SELECT user_id FROM grants WHERE tier = ? AND {MEMBER_SQL} ORDER BY user_id LIMIT ?', (tier, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def add(self, user_id, tier, expires_at=None):
+        """Grant a tier to a user, until expires_at if given; other tiers are kept"""
+        self._write(GRANT_SQL, (user_id, tier, expires_at))
+
+    def remove(self, user_id):
+        """Revoke every tier of a user"""
+        self._write('DELETE FROM grants WHERE user_id = ?', (user_id,))
+
+    def add_many(self, user_ids, tier, expires_at=None):
+        """Grant a tier to many users in one transaction; returns {user_id: previous tier}"""
+        user_ids = list(user_ids)
+        previous = self._tiers(user_ids)
+        self._write(GRANT_SQL, [(user_id, tier, expires_at) for user_id in user_ids], many=True)
+        return previous
+
+    def remove_many(self, user_ids):
+        """Revoke every tier of many users in one transaction; returns {user_id: previous tier}"""
+        user_ids = list(user_ids)
+        previous = self._tiers(user_ids)
+        self._write('DELETE FROM grants WHERE user_id = ?', [(user_id,) for user_id in user_ids], many=True)
+        return previous
+
+    def expire(self, user_ids, now):
+        """Revoke the grants of these users that expired by now; returns [(user_id, tier)]"""
+        revoked = []
+        # Only the process whose DELETE removed a row gets it back, so a
+        # grant is reported once even when several workers schedule it
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            revoked += self._write(
+                f'DELETE FROM grants WHERE user_id IN ({placeholders}) AND expires_at <= ? '
+                'RETURNING user_id, tier', (*chunk, now)
+            )
+        return revoked
+
+    def close(self):
+        """Flush pending writes and stop the writer thread"""
+        if self.writer is not None:
+            self.pending.put(None)
+            self.writer.join()
+            self.writer = None
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def _tiers(self, user_ids):
+        tiers = dict.fromkeys(user_ids)
+        conn = self._conn()
+        # Stay under SQLite's limit on bound parameters
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for user_id, tier in conn.execute(
+                f'SELECT user_id, tier FROM grants WHERE user_id IN ({placeholders}) '
+                'AND (expires_at IS NULL OR expires_at > ?)', (*chunk, time.time())
+            ):
+                if tiers[user_id] != 'advanced':
+                    tiers[user_id] = tier
+        return tiers
+
+    def _write(self, sql, params, many=False):
+        """Queue a statement (executemany if many), wait until its group has been committed and return its rows"""
+        done = threading.Event()
+        item = {'sql': sql, 'params': params, 'many': many, 'done': done, 'error': None, 'rows': []}
+        self.pending.put(item)
+        done.wait()
+        if item['error'] is not None:
+            raise item['error']
+        return item['rows']
+
+    def _writer(self):
+        conn = self._conn()
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.pending.put(None)
+                    break
+                batch.append(item)
+
+            try:
+                with conn:
+                    for item in batch:
+                        if item['many']:
+                            conn.executemany(item['sql'], item['params'])
+                        else:
+                            item['rows'] = conn.execute(item['sql'], item['params']).fetchall()
+            except Exception as e:
+                # Anything else would kill the writer and leave every caller waiting
+                logger.error("User store write failed: %s", e)
+                for item in batch:
+                    item['error'] = e
+            for item in batch:
+                item['done'].set()
+
+
+class LazyStore:
+    """Stand-in that opens and loads the real store on first use.
+
+    Lets the bot answer its first webhook without reading the store at
+    startup. Every attribute is looked up on the real store; closing a
+    store that was never used does nothing.
+    """
+
+    def __init__(self, opener):
+        self.opener = opener
+        self.store = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def load(self):
+        """Open and load the real store unless already done, and return it"""
+        store = self.store
+        if store is None:
+            with self.lock:
+                store = self.store
+                if store is None:
+                    store = self.opener()
+                    store.load()
+                    self.store = store
+        return store
+
+    def close(self):
+        """Close the real store if it was ever opened"""
+        if self.store is not None:
+            self.store.close()
+
+
+class RedisStore:
+    """Premium user store shared by every process and node through Redis.
+
+    Each tier is a sorted set of user ids scored by the id itself, so
+    pages are range queries from a cursor id, and each tier's expiry
+    times live in a sorted set of their own; the user's tier is the
+    highest one that has not expired. Writes are MULTI/EXEC transactions,
+    so there is no lock to hold between processes.
+
+    Tier lookups are cached in each process. Every write publishes the
+    user ids it touched on an invalidation channel, which a subscriber
+    thread in every process listens to, so a grant from any process is
+    seen everywhere on the next lookup. While the subscriber is
+    disconnected the cache is not used.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='bot:', cache_size=100000, cache_ttl=300):
+        # Optional dependency, only needed with USER_STORE=redis
+        import redis
+        self.redis = redis
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.expires_keys = {tier: prefix + 'expires:' + tier for tier in ('advanced', 'basic')}
+        self.channel = prefix + 'invalidate'
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # Bumped on every invalidation, so a lookup racing a write is not cached
+        self.generation = 0
+        self.subscribed = False
+        self.lock = threading.Lock()
+        self.pubsub = None
+        self.subscriber = None
+
+    def load(self):
+        """Check the connection and start listening for invalidations"""
+        self.client.ping()
+        self._migrate()
+        self.pubsub = self.client.pubsub()
+        self.subscriber = threading.Thread(target=self._listen, name='redis-invalidation')
+        self.subscriber.daemon = True
+        self.subscriber.start()
+
+    def get_tier(self, user_id):
+        """Return the highest tier of a user that has not expired, or None"""
+        return current(self._lookup(user_id), time.time())[0]
+
+    def expires_at(self, user_id):
+        """When the user's current tier expires (seconds since the epoch), or None if it does not"""
+        return current(self._lookup(user_id), time.time())[1]
+
+    def expiring(self):
+        """(user_id, expires_at) of every time-bounded grant"""
+        return [
+            (int(user_id), score) for key in self.expires_keys.values()
+            for user_id, score in self.client.zrange(key, 0, -1, withscores=True)
+        ]
+
+    def count(self, tier):
+        """Number of users whose highest tier is this one"""
+        total = self.client.zcard(self._key(tier))
+        if tier == 'basic':
+            # Advanced users who also hold basic are listed under advanced
+            after = None
+            while True:
+                advanced = self._range('advanced', after, None, 1000)
+                if not advanced:
+                    break
+                total -= sum(score is not None for score in self.client.zmscore(self._key('basic'), advanced))
+                after = advanced[-1]
+        return total
+
+    def iter_users(self, tier):
+        """Iterate over the ids of users whose highest tier is this one, a page at a time"""
+        users = self.page(tier, limit=1000)
+        while users:
+            yield from users
+            users = self.page(tier, after=users[-1], limit=1000)
+
+    def page(self, tier, after=None, before=None, limit=50):
+        """Up to limit ids of a tier in ascending order, after or before a cursor id"""
+        backwards = before is not None
+        users = []
+        while len(users) < limit:
+            batch = self._range(tier, after, before, limit)
+            if not batch:
+                break
+            if backwards:
+                before = batch[0]
+            else:
+                after = batch[-1]
+            if tier == 'basic':
+                batch = [user_id for user_id, score in zip(batch, self.client.zmscore(self._key('advanced'), batch))
+                         if score is None]
+            users = batch + users if backwards else users + batch
+        return users[-limit:] if backwards else users[:limit]
+
+    def add(self, user_id, tier, expires_at=None):
+        """Grant a tier to a user, until expires_at if given"""
+        self.add_many([user_id], tier, expires_at)
+
+    def remove(self, user_id):
+        """Revoke every tier of a user"""
+        self.remove_many([user_id])
+
+    def add_many(self, user_ids, tier, expires_at=None):
+        """Grant a tier to many users in one transaction; returns {user_id: previous tier}"""
+        user_ids = list(user_ids)
+        previous = self._tiers(user_ids)
+        if user_ids:
+            pipe = self.client.pipeline()
+            pipe.zadd(self._key(tier), {user_id: user_id for user_id in user_ids})
+            if expires_at is None:
+                pipe.zrem(self.expires_keys[tier], *user_ids)
+            else:
+                pipe.zadd(self.expires_keys[tier], {user_id: expires_at for user_id in user_ids})
+            self._invalidate(pipe, user_ids)
+            pipe.execute()
+        return previous
+
+    def remove_many(self, user_ids):
+        """Revoke every tier of many users in one transaction; returns {user_id: previous tier}"""
+        user_ids = list(user_ids)
+        previous = self._tiers(user_ids)
+        if user_ids:
+            pipe = self.client.pipeline()
+            self._remove(pipe, user_ids)
+            pipe.execute()
+        return previous
+
+    def expire(self, user_ids, now):
+        """Revoke the grants of these users that expired by now; returns [(user_id, tier)]"""
+        if not user_ids:
+            return []
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    # A renewal or another process expiring the same users aborts the transaction
+                    pipe.watch(*self.expires_keys.values())
+                    due = {}
+                    for tier, key in self.expires_keys.items():
+                        scores = pipe.zmscore(key, user_ids)
+                        due[tier] = [user_id for user_id, score in zip(user_ids, scores)
+                                     if score is not None and score <= now]
+                    if not any(due.values()):
+                        pipe.unwatch()
+                        return []
+                    pipe.multi()
+                    for tier, expired in due.items():
+                        if expired:
+                            pipe.zrem(self._key(tier), *expired)
+                            pipe.zrem(self.expires_keys[tier], *expired)
+                    self._invalidate(pipe, [user_id for expired in due.values() for user_id in expired])
+                    pipe.execute()
+                    return [(user_id, tier) for tier, expired in due.items() for user_id in expired]
+                except self.redis.WatchError:
+                    continue
+
+    def close(self):
+        """Stop listening for invalidations and close the connections"""
+        pubsub, self.pubsub = self.pubsub, None
+        if pubsub is not None:
+            pubsub.close()
+        self.client.close()
+
+    def _key(self, tier):
+        return self.prefix + ('users:advanced' if tier == 'advanced' else 'users:basic')
+
+    def _tiers(self, user_ids):
+        """Current tier of each user, read in one round trip"""
+        if not user_ids:
+            return {}
+        pipe = self.client.pipeline(transaction=False)
+        for tier in ('advanced', 'basic'):
+            pipe.zmscore(self._key(tier), user_ids)
+            pipe.zmscore(self.expires_keys[tier], user_ids)
+        advanced, advanced_expires, basic, basic_expires = pipe.execute()
+        now = time.time()
+        return {
+            user_id: current({
+                'advanced': (held_advanced is not None, expires_advanced),
+                'basic': (held_basic is not None, expires_basic)
+            }, now)[0]
+            for user_id, held_advanced, expires_advanced, held_basic, expires_basic
+            in zip(user_ids, advanced, advanced_expires, basic, basic_expires)
+        }
+
+    def _range(self, tier, after, before, limit):
+        """Up to limit ids in a tier's set in ascending order, after or before a cursor id"""
+        if before is not None:
+            users = self.client.zrevrangebyscore(self._key(tier), f'({before}', '-inf', start=0, num=limit)
+            return [int(user_id) for user_id in reversed(users)]
+        low = '-inf' if after is None else f'({after}'
+        return [int(user_id) for user_id in self.client.zrangebyscore(self._key(tier), low, '+inf', start=0, num=limit)]
+
+    def _remove(self, pipe, user_ids):
+        for tier in ('advanced', 'basic'):
+            pipe.zrem(self._key(tier), *user_ids)
+            pipe.zrem(self.expires_keys[tier], *user_ids)
+        self._invalidate(pipe, user_ids)
+
+    def _migrate(self):
+        """Split the single expiry set of stores from before per-tier expiry"""
+        old_key = self.prefix + 'expires'
+        entries = self.client.zrange(old_key, 0, -1, withscores=True)
+        if not entries:
+            return
+        user_ids = [int(user_id) for user_id, _ in entries]
+        pipe = self.client.pipeline()
+        for tier in ('advanced', 'basic'):
+            held = self.client.zmscore(self._key(tier), user_ids)
+            timed = {user_id: expires_at for (user_id, expires_at), score in zip(entries, held) if score is not None}
+            if timed:
+                pipe.zadd(self.expires_keys[tier], timed, nx=True)
+        pipe.delete(old_key)
+        pipe.execute()
+        logger.info("Moved %d expiry times to per-tier sets", len(entries))
+
+    def _invalidate(self, pipe, user_ids):
+        # Drop our own entries right away, the other processes hear it on the channel
+        self._forget(user_ids)
+        pipe.publish(self.channel, ','.join(str(user_id) for user_id in user_ids))
+
+    def _lookup(self, user_id):
+        """{tier: (held, expires_at)} of a user through the per-process cache"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.cache.get(user_id)
+            if entry is not None and self.subscribed and now - entry[1] < self.cache_ttl:
+                self.cache.move_to_end(user_id)
+                return entry[0]
+            generation = self.generation
+
+        pipe = self.client.pipeline(transaction=False)
+        for tier in ('advanced', 'basic'):
+            pipe.zscore(self._key(tier), user_id)
+            pipe.zscore(self.expires_keys[tier], user_id)
+        advanced, advanced_expires, basic, basic_expires = pipe.execute()
+        grants = {'advanced': (advanced is not None, advanced_expires), 'basic': (basic is not None, basic_expires)}
+
+        with self.lock:
+            if self.subscribed and generation == self.generation:
+                self.cache[user_id] = (grants, now)
+                self.cache.move_to_end(user_id)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return grants
+
+    def _forget(self, user_ids):
+        with self.lock:
+            self.generation += 1
+            if user_ids is None:
+                self.cache.clear()
+                return
+            for user_id in user_ids:
+                self.cache.pop(user_id, None)
+
+    def _listen(self):
+        while self.pubsub is not None:
+            try:
+                self.pubsub.subscribe(self.channel)
+                for message in self.pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        # Anything cached before now may have missed an invalidation
+                        self._forget(None)
+                        self.subscribed = True
+                    elif message['type'] == 'message':
+                        self._forget([int(user_id) for user_id in message['data'].split(',') if user_id])
+            except Exception as e:
+                if self.pubsub is None:
+                    break
+                logger.warning("Lost the user store invalidation channel: %s", e)
+            self.subscribed = False
+            self._forget(None)
+            time.sleep(1)
+
+
+def web_workers():
+    """Worker processes gunicorn.conf.py starts: WEB_CONCURRENCY, but one with the JSON store"""
+    # The JSON store lives in process memory; SQLite and Redis are shared
+    if os.getenv('USER_STORE', 'json') == 'json':
+        return 1
+    return int(os.getenv('WEB_CONCURRENCY', '1'))
+
+
+def current(grants, now):
+    """(tier, expires_at) of the highest grant still valid at now, from {tier: (held, expires_at)}"""
+    for tier in ('advanced', 'basic'):
+        held, expires_at = grants[tier]
+        if held and (expires_at is None or expires_at > now):
+            return tier, expires_at
+    return None, None
+
+
+def open_store(backend, path=None):
+    """Create the user store for a backend name ('json', 'sqlite' or 'redis')"""
+    if backend == 'sqlite':
+        return SqliteStore(path or 'premium_users.db')
+    if backend == 'redis':
+        # path is the Redis URL
+        return RedisStore(
+            path or os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            prefix=os.getenv('REDIS_PREFIX', 'bot:')
+        )
+    if backend == 'json':
+        compact_every = int(os.getenv('USER_STORE_COMPACT_EVERY', '1000'))
+        return JsonStore(path or 'premium_users.json', compact_every=compact_every)
+    raise ValueError(f"Unknown user store backend: {backend}")